@@ -1,5 +1,5 @@
 import os
-from flask import Flask, send_from_directory
+from flask import Flask, Response, jsonify, request, send_from_directory
 from flask_cors import CORS
 from dotenv import load_dotenv
 import pathlib
@@ -10,14 +10,33 @@ current_dir = pathlib.Path(__file__).parent.absolute()
 uploads_dir = current_dir / 'uploads'
 uploads_dir.mkdir(exist_ok=True)
 
+from routes.uploads import init_uploads
+
 app = Flask(__name__, static_folder='../client/build')
+init_uploads(app)
 CORS(app)
 
 from routes.documents import documents_bp
 from routes.chat import chat_bp
+from routes.cases import cases_bp
+from routes.responses import finalize_response
+from services.metrics import metrics
+from utils import recent_payloads
 
 app.register_blueprint(documents_bp, url_prefix='/api/documents')
 app.register_blueprint(chat_bp, url_prefix='/api/chat')
+app.register_blueprint(cases_bp, url_prefix='/api/cases')
+app.after_request(finalize_response)
+
+@app.route('/api/debug/payloads', methods=['GET'])
+def debug_payloads():
+    """Recent prompts, LLM output and extracted text from the debug ring buffer, ?label= filters them"""
+    return jsonify(recent_payloads(request.args.get('label')))
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Stage latencies, fallbacks, parse failures and downstream load in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
@@ -28,5 +47,10 @@ def serve(path):
         return send_from_directory(app.static_folder, 'index.html')
 
 if __name__ == '__main__':
+    # Development server, see gunicorn.conf.py for running in production
+    from services.ingestion import recover_interrupted_jobs
+    from services.reextraction import start_reextraction
+    recover_interrupted_jobs()
+    start_reextraction()
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=True)
@@ -0,0 +1,76 @@
+"""
+ASGI variant of the backend, serving the same API as app.py from one event loop.
+Start it with: hypercorn asgi:app --bind 0.0.0.0:5000
+Needs the packages in requirements-asgi.txt.
+"""
+import os
+import pathlib
+from quart import Quart, Request, Response, jsonify, request
+from quart.formparser import FormDataParser
+from quart_cors import cors
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+current_dir = pathlib.Path(__file__).parent.absolute()
+uploads_dir = current_dir / 'uploads'
+uploads_dir.mkdir(exist_ok=True)
+
+from services.blob_store import UPLOAD_MAX_REQUEST_BYTES, blob_store
+
+SHUTDOWN_DRAIN_SECONDS = int(os.environ.get('SHUTDOWN_DRAIN_SECONDS', '900'))
+
+class AsyncUploadRequest(Request):
+    def make_form_data_parser(self):
+        # Uploaded files go straight to disk, hashed and size checked while they are received
+        return FormDataParser(
+            max_content_length=self.max_content_length,
+            max_form_memory_size=self.max_form_memory_size,
+            max_form_parts=self.max_form_parts,
+            cls=self.parameter_storage_class,
+            stream_factory=lambda *args: blob_store.upload_stream()
+        )
+
+app = Quart(__name__)
+app.request_class = AsyncUploadRequest
+# Each file is limited while it is received, this bounds a request carrying many of them
+app.config['MAX_CONTENT_LENGTH'] = UPLOAD_MAX_REQUEST_BYTES
+# Large uploads over slow connections take longer than Quart's default of a minute
+app.config['BODY_TIMEOUT'] = int(os.environ.get('UPLOAD_BODY_TIMEOUT', '600'))
+app = cors(app)
+
+from routes.documents_async import documents_bp
+from routes.chat_async import chat_bp
+from routes.cases_async import cases_bp
+from routes.responses import finalize_async_response
+from services.async_http_client import async_llm_client
+from services.ingestion import drain, recover_interrupted_jobs
+from services.metrics import metrics
+from services.reextraction import reextraction_queue, start_reextraction
+from utils import recent_payloads
+
+app.register_blueprint(documents_bp, url_prefix='/api/documents')
+app.register_blueprint(chat_bp, url_prefix='/api/chat')
+app.register_blueprint(cases_bp, url_prefix='/api/cases')
+app.after_request(finalize_async_response)
+
+@app.route('/api/debug/payloads', methods=['GET'])
+def debug_payloads():
+    return jsonify(recent_payloads(request.args.get('label')))
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.before_serving
+async def startup():
+    # One process serves everything, nothing else can be running these jobs
+    recover_interrupted_jobs()
+    reextraction_queue.watch(async_llm_client)
+    start_reextraction()
+
+@app.after_serving
+async def shutdown():
+    await app.ensure_async(reextraction_queue.stop)(SHUTDOWN_DRAIN_SECONDS)
+    await app.ensure_async(drain)(SHUTDOWN_DRAIN_SECONDS)
+    await async_llm_client.close()
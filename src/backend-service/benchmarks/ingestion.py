@@ -0,0 +1,238 @@
+"""
+End-to-end ingestion benchmark. Uploads the documents in example-data through the real
+Flask routes, in process, with the llama server and Nougat replaced by the stand-ins in
+benchmarks/stand_ins.py, then asks a few chat questions. Run from the backend directory:
+
+    python -m benchmarks.ingestion --rounds 3 --output results.json --baseline baseline.json
+
+Reports documents per second, p50/p95/p99 per stage and peak RSS, writes them as JSON,
+and exits with status 1 when a run is slower than the baseline by more than --tolerance.
+"""
+import os
+import sys
+import json
+import glob
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import platform
+
+from benchmarks.stand_ins import Faults, StandInServer, llm_app, nougat_app
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLE_DATA = os.path.join(BACKEND_DIR, '..', '..', 'example-data')
+CHAT_QUESTIONS = [
+    "When was the shipment delayed?",
+    "Who was notified about the damaged goods?",
+    "What happened after the goods were inspected?"
+]
+# Stage percentiles moving by less than this many seconds are noise, not a regression
+NOISE_FLOOR_SECONDS = 0.02
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', nargs='+', help="Files to upload, every PDF and DOCX in example-data by default")
+    parser.add_argument('--rounds', type=int, default=3, help="Times the documents are uploaded, one job per round")
+    parser.add_argument('--warm', action='store_true', help="Keep the extraction cache between rounds")
+    parser.add_argument('--chat', type=int, default=len(CHAT_QUESTIONS), help="Chat questions asked after ingestion")
+    parser.add_argument('--prefill-rate', type=float, default=2000, help="Stand-in LLM prompt tokens per second")
+    parser.add_argument('--decode-rate', type=float, default=100, help="Stand-in LLM generated tokens per second")
+    parser.add_argument('--llm-slots', type=int, default=4, help="Requests the stand-in LLM runs at once")
+    parser.add_argument('--nougat-page-seconds', type=float, default=0.5, help="Stand-in Nougat seconds per page")
+    parser.add_argument('--nougat-instances', type=int, default=1)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of stand-in requests failing with a 500")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the stand-ins' failure draws")
+    parser.add_argument('--timeout', type=float, default=600, help="Seconds to wait for a round's job")
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--baseline', help="Results of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="Allowed slowdown against the baseline, 0.1 is 10%%")
+    return parser.parse_args()
+
+def configure_environment(work_dir, llm_url, nougat_urls):
+    """Point the backend at the stand-ins and a scratch directory, before any of it is imported"""
+    os.environ.update({
+        'DATABASE_PATH': os.path.join(work_dir, 'chronolaw.db'),
+        'EXTRACTION_CACHE_DIR': os.path.join(work_dir, 'cache'),
+        'UPLOAD_DIR': os.path.join(work_dir, 'uploads'),
+        'LLM_ENDPOINT_PATH': f"{llm_url}/answer",
+        'PDF_PARSER_ENDPOINT_PATH': ",".join(f"{url}/predict" for url in nougat_urls),
+    })
+    os.environ.pop('EMBEDDING_ENDPOINT_PATH', None)
+    os.environ.pop('METRICS_DIR', None)
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+def create_app():
+    """The API of app.py without .env loading, which would override the environment set above"""
+    from flask import Flask
+    from routes.uploads import init_uploads
+    from routes.documents import documents_bp
+    from routes.chat import chat_bp
+    from routes.cases import cases_bp
+    from routes.responses import finalize_response
+
+    app = Flask(__name__)
+    init_uploads(app)
+    app.register_blueprint(documents_bp, url_prefix='/api/documents')
+    app.register_blueprint(chat_bp, url_prefix='/api/chat')
+    app.register_blueprint(cases_bp, url_prefix='/api/cases')
+    app.after_request(finalize_response)
+    return app
+
+def wait_for_job(client, job_id, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f'/api/documents/jobs/{job_id}').get_json()
+        if job['status'] in ('completed', 'failed'):
+            return job
+        time.sleep(0.05)
+    raise TimeoutError(f"Job {job_id} did not finish within {timeout}s")
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def summarize(samples):
+    values = sorted(samples)
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+    }
+
+def stage_name(name, labels):
+    if name == "chronolaw_stage_duration_seconds":
+        return labels["stage"]
+    return f"llm_{labels['task']}_{labels['phase']}"
+
+def run(args):
+    documents = args.documents or sorted(
+        glob.glob(os.path.join(EXAMPLE_DATA, '*.pdf')) + glob.glob(os.path.join(EXAMPLE_DATA, '*.docx'))
+    )
+    if not documents:
+        raise SystemExit("No documents to upload")
+
+    llm = StandInServer(llm_app(
+        args.prefill_rate, args.decode_rate, args.llm_slots, Faults(args.error_rate, seed=args.seed)
+    )).start()
+    nougats = [
+        StandInServer(nougat_app(args.nougat_page_seconds, faults=Faults(args.error_rate, seed=args.seed + number))).start()
+        for number in range(args.nougat_instances)
+    ]
+    work_dir = tempfile.mkdtemp(prefix='chronolaw-benchmark-')
+    configure_environment(work_dir, llm.url, [nougat.url for nougat in nougats])
+    sys.path.insert(0, BACKEND_DIR)
+
+    from services.extraction_cache import extraction_cache
+    from services.ingestion import drain
+    from services.metrics import metrics
+
+    app = create_app()
+    client = app.test_client()
+    rounds = []
+    try:
+        with metrics.recording() as observations:
+            for number in range(args.rounds):
+                if not args.warm:
+                    extraction_cache.clear()
+                files = [(open(path, 'rb'), os.path.basename(path)) for path in documents]
+                started = time.perf_counter()
+                try:
+                    response = client.post('/api/documents/upload', data={'documents': files})
+                finally:
+                    for f, _ in files:
+                        f.close()
+                if response.status_code != 202:
+                    raise SystemExit(f"Upload failed with {response.status_code}: {response.get_data(as_text=True)}")
+                job = wait_for_job(client, response.get_json()['jobId'], args.timeout)
+                seconds = time.perf_counter() - started
+                rounds.append({"round": number + 1, "seconds": seconds, "status": job['status']})
+                print(f"Round {number + 1}: {len(documents)} documents in {seconds:.2f}s ({job['status']})")
+
+            for question in (CHAT_QUESTIONS * args.chat)[:args.chat]:
+                client.post('/api/chat/receive', json={"message": question})
+        counters = metrics.snapshot()["counters"]
+    finally:
+        drain(args.timeout)
+        llm.stop()
+        for nougat in nougats:
+            nougat.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    stages = {}
+    for name, labels, seconds in observations:
+        stages.setdefault(stage_name(name, labels), []).append(seconds)
+    total_seconds = sum(round_["seconds"] for round_ in rounds)
+
+    return {
+        "createdAt": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "config": {
+            "documents": [os.path.basename(path) for path in documents],
+            **{key: value for key, value in vars(args).items() if key not in ('documents', 'output', 'baseline')}
+        },
+        "rounds": rounds,
+        "documentsPerSecond": len(documents) * len(rounds) / total_seconds,
+        # ru_maxrss is in kilobytes on Linux, the stand-ins run in this process too
+        "peakRssBytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "stages": {stage: summarize(samples) for stage, samples in sorted(stages.items())},
+        "counters": {
+            f"{name}{{{','.join(f'{key}={value}' for key, value in labels)}}}": value
+            for name, labels, value in counters
+        },
+    }
+
+def compare(results, baseline, tolerance):
+    """Lines describing where results are worse than baseline by more than tolerance"""
+    regressions = []
+    before, after = baseline["documentsPerSecond"], results["documentsPerSecond"]
+    if after < before * (1 - tolerance):
+        regressions.append(f"documentsPerSecond {before:.3f} -> {after:.3f}")
+    before, after = baseline["peakRssBytes"], results["peakRssBytes"]
+    if after > before * (1 + tolerance):
+        regressions.append(f"peakRssBytes {before / 2**20:.1f}MB -> {after / 2**20:.1f}MB")
+    for stage, summary in results["stages"].items():
+        if stage not in baseline["stages"]:
+            continue
+        for key in ("p50", "p95", "p99"):
+            before, after = baseline["stages"][stage][key], summary[key]
+            if after > before * (1 + tolerance) and after - before > NOISE_FLOOR_SECONDS:
+                regressions.append(f"{stage} {key} {before * 1000:.1f}ms -> {after * 1000:.1f}ms")
+    return regressions
+
+def report(results):
+    print(f"\n{results['documentsPerSecond']:.3f} documents/s, peak RSS {results['peakRssBytes'] / 2**20:.1f}MB\n")
+    print(f"{'stage':<28}{'count':>7}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}")
+    for stage, summary in results["stages"].items():
+        print(f"{stage:<28}{summary['count']:>7}"
+              f"{summary['p50'] * 1000:>11.1f}{summary['p95'] * 1000:>11.1f}{summary['p99'] * 1000:>11.1f}")
+    for name, value in results["counters"].items():
+        print(f"{name} {value}")
+
+def main():
+    args = parse_args()
+    results = run(args)
+    report(results)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\nSlower than {args.baseline} by more than {args.tolerance:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nWithin {args.tolerance:.0%} of {args.baseline}")
+
+if __name__ == '__main__':
+    main()
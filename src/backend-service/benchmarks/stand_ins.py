@@ -0,0 +1,385 @@
+"""
+Deterministic stand-ins for the llama server and Nougat, so the backend can be
+benchmarked and load tested without a GGUF model or a GPU. They answer with the
+request and response shapes of llm-service's /answer and /tokenize and of
+nougat-service's /predict/. Answers are derived from a hash of the request and take
+as long as the configured prefill, decode and page rates say. Run one on its own with:
+
+    python -m benchmarks.stand_ins llm --port 8080 --prefill-rate 2000 --decode-rate 100 --slots 4
+    python -m benchmarks.stand_ins nougat --port 8503 --page-seconds 2 --error-rate 0.1
+"""
+import json
+import time
+import queue
+import random
+import hashlib
+import argparse
+import threading
+from contextlib import contextmanager
+from flask import Flask, Response, jsonify, request
+from werkzeug.serving import WSGIRequestHandler, make_server
+import pymupdf
+
+from services.chunking import CHARS_PER_TOKEN, estimate_tokens
+
+EVENT_TITLES = [
+    "Contract signed", "Shipment dispatched", "Delivery delayed", "Invoice issued",
+    "Payment received", "Notice of claim served", "Goods inspected", "Meeting held"
+]
+CHAT_ANSWER = "According to the documents, the shipment was delayed. (logistics-anonymised-doc-1)"
+
+def canned_events(prompt, count=3):
+    """The same events for the same prompt, dated across 2018 to 2021"""
+    rng = random.Random(hashlib.sha256(prompt.encode('utf-8')).digest())
+    events = []
+    for _ in range(count):
+        title = rng.choice(EVENT_TITLES)
+        date = f"{rng.randint(2018, 2021)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        events.append({
+            "title": title,
+            "date": date,
+            "description": f"{title} on {date} according to the document.",
+            "participants": ["Claimant", "Respondent"],
+            "context": f"Reference {rng.randint(1000, 9999)} in the correspondence."
+        })
+    return events
+
+def common_prefix_length(a, b):
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
+
+def split_tokens(text):
+    """Stand-in tokens: CHARS_PER_TOKEN characters each, the same count estimate_tokens gives"""
+    return [text[i:i + CHARS_PER_TOKEN] for i in range(0, len(text), CHARS_PER_TOKEN)]
+
+class Faults:
+    """
+    Failure injection shared by the stand-ins. Each request draws once: an error
+    response, a hang of hang_seconds before answering, a malformed body, or nothing.
+    Draws come from a seeded generator, so a run can be repeated.
+    """
+    def __init__(self, error_rate=0.0, hang_rate=0.0, hang_seconds=30.0, malformed_rate=0.0, seed=0):
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.malformed_rate = malformed_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def draw(self):
+        with self.lock:
+            value = self.random.random()
+        for fault, rate in (("error", self.error_rate), ("hang", self.hang_rate), ("malformed", self.malformed_rate)):
+            if value < rate:
+                return fault
+            value -= rate
+        return None
+
+class SlotPool:
+    """
+    The llama server's slots (--parallel). A request waits for a free slot, id_slot pins
+    it to one, and each slot remembers its last prompt so a shared prefix is not
+    processed again, as with cache_prompt.
+    """
+    def __init__(self, count):
+        self.prompts = [""] * count
+        self.busy = [False] * count
+        self.condition = threading.Condition()
+
+    def pick(self, prompt, id_slot):
+        if 0 <= id_slot < len(self.busy):
+            return None if self.busy[id_slot] else id_slot
+        free = [index for index, busy in enumerate(self.busy) if not busy]
+        if not free:
+            return None
+        # Like the server, prefer the free slot holding the longest part of this prompt
+        return max(free, key=lambda index: common_prefix_length(self.prompts[index], prompt))
+
+    @contextmanager
+    def acquire(self, prompt, id_slot=-1, cache_prompt=True):
+        """Yields (slot index, characters of the prompt already in the slot's cache)"""
+        with self.condition:
+            while (index := self.pick(prompt, id_slot)) is None:
+                self.condition.wait()
+            self.busy[index] = True
+            cached = common_prefix_length(self.prompts[index], prompt) if cache_prompt else 0
+        try:
+            yield index, cached
+        finally:
+            with self.condition:
+                self.prompts[index] = prompt
+                self.busy[index] = False
+                self.condition.notify_all()
+
+class GenerationCancelled(Exception):
+    """The client of a streamed answer went away"""
+
+def error_response(message, code=500):
+    """llama server error body"""
+    return jsonify({"error": {"code": code, "message": message, "type": "server_error"}}), code
+
+def llm_app(prefill_tokens_per_second=2000, decode_tokens_per_second=100, slots=4, faults=None, events=None):
+    """
+    The llama server's /answer, /tokenize and /health. `prompt` may be one prompt or an
+    array of them, `stream` relays tokens as server-sent events, and a request with a
+    `json_schema` is answered with events: from `events`, a list of event lists picked
+    by prompt hash, or generated ones.
+    """
+    app = Flask('llm-stand-in')
+    faults = faults or Faults()
+    slot_pool = SlotPool(slots)
+
+    def completion_content(prompt, body):
+        if not body.get('json_schema'):
+            return CHAT_ANSWER
+        if events:
+            return json.dumps(events[int(hashlib.sha256(prompt.encode('utf-8')).hexdigest(), 16) % len(events)])
+        return json.dumps(canned_events(prompt))
+
+    def run_task(index, prompt, body, emit=None):
+        """The final result of one prompt, calling emit(chunk) for every token when streaming"""
+        tokens = split_tokens(completion_content(prompt, body))
+        n_predict = body.get('n_predict', -1)
+        limited = 0 <= n_predict < len(tokens)
+        if limited:
+            tokens = tokens[:n_predict]
+        prompt_tokens = estimate_tokens(prompt)
+
+        with slot_pool.acquire(prompt, body.get('id_slot', -1), body.get('cache_prompt', True)) as (slot, cached):
+            cached_tokens = min(cached // CHARS_PER_TOKEN, prompt_tokens)
+            prompt_seconds = (prompt_tokens - cached_tokens) / prefill_tokens_per_second
+            time.sleep(prompt_seconds)
+            token_seconds = 1 / decode_tokens_per_second
+            if emit is None:
+                time.sleep(token_seconds * len(tokens))
+            else:
+                for token in tokens:
+                    time.sleep(token_seconds)
+                    emit({
+                        "index": index, "content": token, "tokens": [], "stop": False, "id_slot": slot,
+                        "tokens_predicted": 1, "tokens_evaluated": prompt_tokens
+                    })
+
+        predicted_seconds = token_seconds * len(tokens)
+        prompt_n = max(prompt_tokens - cached_tokens, 1)
+        predicted_n = max(len(tokens), 1)
+        return {
+            "index": index,
+            "content": "" if emit else "".join(tokens),
+            "tokens": [],
+            "id_slot": slot,
+            "stop": True,
+            "model": "stand-in",
+            "tokens_predicted": len(tokens),
+            "tokens_evaluated": prompt_tokens,
+            "prompt": prompt,
+            "has_new_line": False,
+            "truncated": False,
+            "stop_type": "limit" if limited else "eos",
+            "stopping_word": "",
+            "tokens_cached": cached_tokens + len(tokens),
+            "timings": {
+                "prompt_n": prompt_tokens - cached_tokens,
+                "prompt_ms": prompt_seconds * 1000,
+                "prompt_per_token_ms": prompt_seconds * 1000 / prompt_n,
+                "prompt_per_second": prompt_n / prompt_seconds if prompt_seconds else 0,
+                "predicted_n": len(tokens),
+                "predicted_ms": predicted_seconds * 1000,
+                "predicted_per_token_ms": predicted_seconds * 1000 / predicted_n,
+                "predicted_per_second": decode_tokens_per_second
+            }
+        }
+
+    def prompts_of(body):
+        """One prompt, or several when prompt is an array of strings. A token array counts as one prompt."""
+        prompt = body['prompt']
+        if isinstance(prompt, list) and prompt and all(isinstance(item, str) for item in prompt):
+            return prompt
+        if isinstance(prompt, list):
+            return [" ".join(str(item) for item in prompt)]
+        return [prompt]
+
+    def stream_tokens(prompts, body):
+        """Server-sent events token by token, one prompt after the other. Closing the connection stops generation."""
+        cancelled = threading.Event()
+        chunks = queue.Queue()
+
+        def emit(chunk):
+            if cancelled.is_set():
+                raise GenerationCancelled()
+            chunks.put(chunk)
+
+        def produce():
+            try:
+                for index, prompt in enumerate(prompts):
+                    chunks.put(run_task(index, prompt, body, emit))
+            except GenerationCancelled:
+                pass
+            finally:
+                chunks.put(None)
+
+        def generate():
+            threading.Thread(target=produce, daemon=True).start()
+            try:
+                while (chunk := chunks.get()) is not None:
+                    yield f"data: {json.dumps(chunk)}\n\n"
+            finally:
+                cancelled.set()
+
+        return Response(generate(), mimetype='text/event-stream')
+
+    @app.route('/health', methods=['GET'])
+    def health():
+        return jsonify({"status": "ok"})
+
+    @app.route('/answer', methods=['POST'])
+    def answer():
+        body = request.get_json()
+        if not body or 'prompt' not in body:
+            return error_response("\"prompt\" must be provided", 400)
+        fault = faults.draw()
+        if fault == "error":
+            return error_response("Injected failure")
+        if fault == "hang":
+            time.sleep(faults.hang_seconds)
+        prompts = prompts_of(body)
+
+        if body.get('stream'):
+            return stream_tokens(prompts, body)
+
+        if len(prompts) == 1:
+            results = [run_task(0, prompts[0], body)]
+        else:
+            # Several prompts run side by side on free slots, as separate tasks do on the server
+            results = [None] * len(prompts)
+
+            def run(index):
+                results[index] = run_task(index, prompts[index], body)
+
+            threads = [threading.Thread(target=run, args=(index,)) for index in range(len(prompts))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        if fault == "malformed":
+            # Cut off half way, as when a proxy drops the connection
+            text = json.dumps(results[0] if len(results) == 1 else results)
+            return Response(text[:len(text) // 2], mimetype='application/json')
+        return jsonify(results[0] if len(results) == 1 else results)
+
+    @app.route('/tokenize', methods=['POST'])
+    def tokenize():
+        body = request.get_json()
+        if body.get('batch'):
+            return jsonify({"tokens": [list(range(estimate_tokens(text))) for text in body['content']]})
+        return jsonify({"tokens": list(range(estimate_tokens(body['content'])))})
+
+    return app
+
+def nougat_app(seconds_per_page=0.5, slots=1, faults=None):
+    """
+    Nougat's /predict/, taking seconds_per_page for every page of the requested range
+    and at most `slots` requests at a time. Injected malformed responses are empty.
+    """
+    app = Flask('nougat-stand-in')
+    faults = faults or Faults()
+    slot_semaphore = threading.BoundedSemaphore(slots)
+
+    @app.route('/', methods=['GET'])
+    def root():
+        return jsonify({"status-code": 200, "data": {}})
+
+    @app.route('/predict', methods=['POST'])
+    @app.route('/predict/', methods=['POST'])
+    def predict():
+        if 'file' not in request.files:
+            return jsonify({"detail": [{"loc": ["body", "file"], "msg": "field required", "type": "value_error.missing"}]}), 422
+        pdf = request.files['file'].read()
+        start = request.args.get('start', type=int)
+        stop = request.args.get('stop', type=int)
+        if start is None or stop is None:
+            with pymupdf.open(stream=pdf, filetype='pdf') as reader:
+                start, stop = 1, len(reader)
+
+        fault = faults.draw()
+        if fault == "error":
+            return jsonify({"detail": "Injected failure"}), 500
+        if fault == "hang":
+            time.sleep(faults.hang_seconds)
+
+        with slot_semaphore:
+            time.sleep((stop - start + 1) * seconds_per_page)
+
+        if fault == "malformed":
+            return jsonify("")
+        digest = hashlib.sha256(pdf).hexdigest()[:8]
+        pages = [
+            f"## Page {number}\n\nOn 2019-03-{number % 28 + 1:02d} the goods under order {digest} were "
+            f"inspected at the warehouse and found damaged. The carrier was notified in writing.\n\n"
+            for number in range(start, stop + 1)
+        ]
+        # FastAPI returns the markdown as a JSON string
+        return jsonify("".join(pages).strip())
+
+    return app
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args):
+        pass
+
+class StandInServer:
+    """A stand-in app served from a background thread, on a free port unless one is given"""
+    def __init__(self, app, host='127.0.0.1', port=0):
+        self.server = make_server(host, port, app, threaded=True, request_handler=QuietRequestHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name=f'{app.name}-server', daemon=True)
+
+    @property
+    def url(self):
+        return f"http://{self.server.host}:{self.server.server_port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('service', choices=['llm', 'nougat'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, help="8080 for llm, 8503 for nougat by default")
+    parser.add_argument('--prefill-rate', type=float, default=2000, help="Prompt tokens per second")
+    parser.add_argument('--decode-rate', type=float, default=100, help="Generated tokens per second")
+    parser.add_argument('--slots', type=int, help="Requests served at once, 4 for llm and 1 for nougat by default")
+    parser.add_argument('--events', help="JSON file with a list of event lists to answer extraction requests with")
+    parser.add_argument('--page-seconds', type=float, default=0.5, help="Nougat seconds per page")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests answered with a 500")
+    parser.add_argument('--hang-rate', type=float, default=0.0, help="Share of requests held for --hang-seconds first")
+    parser.add_argument('--hang-seconds', type=float, default=30.0)
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help="Share of requests with a broken body")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the failure draws")
+    args = parser.parse_args()
+
+    faults = Faults(args.error_rate, args.hang_rate, args.hang_seconds, args.malformed_rate, args.seed)
+    if args.service == 'llm':
+        events = None
+        if args.events:
+            with open(args.events) as f:
+                events = json.load(f)
+        app = llm_app(args.prefill_rate, args.decode_rate, args.slots or 4, faults, events)
+        port = args.port or 8080
+    else:
+        app = nougat_app(args.page_seconds, args.slots or 1, faults)
+        port = args.port or 8503
+
+    server = StandInServer(app, args.host, port)
+    print(f"{app.name} listening on {server.url}")
+    server.server.serve_forever()
+
+if __name__ == '__main__':
+    main()
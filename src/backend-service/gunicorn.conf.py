@@ -0,0 +1,53 @@
+"""
+Production server settings, start with: gunicorn -c gunicorn.conf.py app:app
+"""
+import os
+import glob
+import tempfile
+import multiprocessing
+from dotenv import load_dotenv
+
+# Before on_starting imports app modules: the workers inherit them from the master with their
+# module-level settings already read, app.py's own load_dotenv comes too late for those
+load_dotenv(override=True)
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_WORKERS', str(multiprocessing.cpu_count())))
+# Threads per worker, requests mostly wait on SQLite, the LLM or Nougat
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', '8'))
+timeout = int(os.environ.get('WEB_TIMEOUT', '120'))
+# On SIGTERM workers stop accepting, finish their requests and ingestion jobs, and are killed after this
+graceful_timeout = int(os.environ.get('SHUTDOWN_DRAIN_SECONDS', '900'))
+# The app is imported in every worker. on_starting has already imported models.data and the
+# services in the master, the workers inherit those modules, but data.close() drops the
+# master's SQLite connection and thread pools only start on first use in a worker
+preload_app = False
+# Workers write their metrics here so /metrics on any of them reports the whole server
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), f"chronolaw-metrics-{os.environ.get('PORT', '5000')}"))
+
+def on_starting(server):
+    # Runs once in the master before any worker takes an upload
+    from models.data import data
+    from services.ingestion import recover_interrupted_jobs
+    recover_interrupted_jobs()
+    data.close()
+    # Counters start from zero with the server, not with the last run's files
+    for path in glob.glob(os.path.join(os.environ['METRICS_DIR'], 'metrics-*.json')):
+        os.remove(path)
+
+def post_worker_init(worker):
+    # Every worker runs the queue, documents are claimed in the database so only one is worked on at a time
+    from services.reextraction import start_reextraction
+    start_reextraction()
+
+def worker_exit(server, worker):
+    from services.ingestion import drain
+    from services.metrics import metrics
+    from services.reextraction import reextraction_queue
+    # Its document is given back and picked up by another worker or after the restart
+    reextraction_queue.stop(graceful_timeout)
+    if not drain(graceful_timeout):
+        server.log.warning(f"Worker {worker.pid} exiting with ingestion jobs still running")
+    # What the worker counted keeps adding to the totals after it is gone
+    metrics.flush()
@@ -2,16 +2,666 @@
 Shared data store for the application
 This module provides access to shared data across different routes
 """
+import os
+import re
+import json
+import uuid
+import time
+import sqlite3
+import threading
+from datetime import datetime
 
-# In-memory database (for simplicity)
-# In a production application, this would be replaced with a real database
+from services.dates import NO_YEAR_SORT_KEY, UNDATED_SORT_KEY, normalize_event_date
+from utils import get_file_path, log_message
+
+DATABASE_PATH = os.environ.get('DATABASE_PATH', get_file_path('chronolaw.db'))
+# Requests that name no case, and everything stored before there were cases, belong to this one
+DEFAULT_CASE_ID = 'default'
+# Case ids end up in the names of their search tables
+CASE_ID_PATTERN = re.compile(r'[a-z0-9]{1,32}')
+
+SCHEMA = """
+-- Every document, event and search index belongs to one case, queries never cross cases
+CREATE TABLE IF NOT EXISTS cases (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    description TEXT NOT NULL DEFAULT '',
+    created_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS documents (
+    id TEXT PRIMARY KEY,
+    case_id TEXT NOT NULL DEFAULT 'default',
+    name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    type TEXT NOT NULL,
+    hash TEXT,
+    upload_date TEXT NOT NULL
+);
+
+-- Full text lives apart from the metadata so listing and joins never page it in
+CREATE TABLE IF NOT EXISTS document_texts (
+    document_id TEXT PRIMARY KEY REFERENCES documents(id) ON DELETE CASCADE,
+    text TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    document_id TEXT NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    case_id TEXT NOT NULL DEFAULT 'default',
+    date TEXT NOT NULL DEFAULT '',
+    -- Normalized by services.dates, date keeps the string as extracted
+    date_key INTEGER NOT NULL DEFAULT 0,
+    date_precision TEXT,
+    -- seq of the event this one was merged into, NULL for the events shown on the timeline
+    duplicate_of INTEGER,
+    -- MinHash signature from services.dedup
+    signature BLOB,
+    payload TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS events_document_id ON events (document_id);
+
+-- Uploaded files by content hash, ref_count is the number of documents using the file
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    ref_count INTEGER NOT NULL
+);
+
+-- Short slices of document text that chat retrieval can quote
+CREATE TABLE IF NOT EXISTS passages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    document_id TEXT NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    content TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS passages_document_id ON passages (document_id);
+
+-- Optional embedding vectors, kind is 'event' or 'passage' and ref the matching rowid
+CREATE TABLE IF NOT EXISTS embeddings (
+    kind TEXT NOT NULL,
+    ref INTEGER NOT NULL,
+    vector BLOB NOT NULL,
+    PRIMARY KEY (kind, ref)
+);
+
+-- Which services.extraction_cache.extraction_version() produced a document's stored events,
+-- documents without a row or with another version are re-extracted in the background
+CREATE TABLE IF NOT EXISTS extractions (
+    document_id TEXT PRIMARY KEY REFERENCES documents(id) ON DELETE CASCADE,
+    -- NULL until the LLM stage returned events
+    version TEXT,
+    extracted_at TEXT,
+    -- A failed re-extraction is not retried until the version changes again
+    failed_version TEXT,
+    error TEXT,
+    -- time.time() a worker took the document for re-extraction, NULL when nobody holds it
+    claimed_at REAL
+);
+"""
+
+# Cases with their document and timeline event counts, completed by a WHERE or ORDER BY
+CASE_QUERY = (
+    "SELECT c.id, c.name, c.description, c.created_at, "
+    "(SELECT COUNT(*) FROM documents d WHERE d.case_id = c.id), "
+    "(SELECT COUNT(*) FROM events e WHERE e.case_id = c.id AND e.duplicate_of IS NULL) "
+    "FROM cases c "
+)
+
+def case_from_row(row):
+    return {"id": row[0], "name": row[1], "description": row[2], "createdAt": row[3],
+            "documentCount": row[4], "eventCount": row[5]}
+
+# Created after the migrations, older databases only get date_key and case_id there
+INDEXES = """
+DROP INDEX IF EXISTS events_date;
+DROP INDEX IF EXISTS events_date_key;
+CREATE INDEX IF NOT EXISTS events_case_date_key ON events (case_id, date_key, seq);
+CREATE INDEX IF NOT EXISTS events_duplicate_of ON events (duplicate_of);
+CREATE INDEX IF NOT EXISTS documents_case_id ON documents (case_id, upload_date, id);
+"""
+
+DOCUMENT_COLUMNS = "d.id, d.name, d.path, d.type, d.hash, d.upload_date, d.case_id"
+
+def search_table(kind, case_id):
+    """BM25 index of a case, 'event' or 'passage', rowids match events.seq and passages.id"""
+    return f"{kind}_search_{case_id}"
+
+def document_from_row(row, text=None):
+    document = {
+        "id": row[0],
+        "name": row[1],
+        "path": row[2],
+        "type": row[3],
+        "hash": row[4],
+        "uploadDate": row[5],
+        "caseId": row[6]
+    }
+    if text is not None:
+        document["text"] = text
+    return document
+
+# SQLite database in WAL mode, so readers never wait on an ingestion write
 class Data:
-    def __init__(self):
-        # Array to store document metadata
-        self.documents = []
-        
-        # Array to store timeline events extracted from documents
-        self.timeline_events = []
+    def __init__(self, path=DATABASE_PATH):
+        self.path = path
+
+        # sqlite3 connections cannot be shared across threads, each thread gets its own
+        self.local = threading.local()
+
+        with self.connection() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            self.migrate_events(connection)
+            self.migrate_no_year_keys(connection)
+            self.migrate_cases(connection)
+            connection.executescript(INDEXES)
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            self.local.connection = connection
+        return connection
+
+    def close(self):
+        """Close this thread's connection, a process about to fork must not hand it to its children"""
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+
+    def migrate_events(self, connection):
+        """Add the columns events stored by older versions lack, normalizing their dates"""
+        columns = {row[1] for row in connection.execute("PRAGMA table_info(events)")}
+        if 'duplicate_of' not in columns:
+            connection.execute("ALTER TABLE events ADD COLUMN duplicate_of INTEGER")
+            # Left empty, signatures are computed the first time an event is a dedup candidate
+            connection.execute("ALTER TABLE events ADD COLUMN signature BLOB")
+        if 'date_key' in columns:
+            return
+        connection.execute("ALTER TABLE events ADD COLUMN date_key INTEGER NOT NULL DEFAULT 0")
+        connection.execute("ALTER TABLE events ADD COLUMN date_precision TEXT")
+        rows = connection.execute("SELECT seq, payload FROM events").fetchall()
+        for seq, payload in rows:
+            event = normalize_event_date(json.loads(payload))
+            connection.execute(
+                "UPDATE events SET date_key = ?, date_precision = ?, payload = ? WHERE seq = ?",
+                (event["dateKey"], event["datePrecision"], json.dumps(event), seq)
+            )
+        log_message("Normalized the dates of %s stored events", len(rows))
+
+    def migrate_no_year_keys(self, connection):
+        """Older versions sorted dates without a year before every dated event, and undated ones at 100000000"""
+        connection.execute(
+            "UPDATE events SET date_key = ?, payload = json_set(payload, '$.dateKey', ?) "
+            "WHERE date_key = ? AND date_precision IS NULL",
+            (UNDATED_SORT_KEY, UNDATED_SORT_KEY, NO_YEAR_SORT_KEY)
+        )
+        connection.execute(
+            "UPDATE events SET date_key = date_key + ?, payload = json_set(payload, '$.dateKey', date_key + ?) "
+            "WHERE date_precision = 'no-year' AND date_key < ?",
+            (NO_YEAR_SORT_KEY, NO_YEAR_SORT_KEY, NO_YEAR_SORT_KEY)
+        )
+
+    def migrate_cases(self, connection):
+        """Move what older versions stored, from before there were cases, into the default case"""
+        for table in ('documents', 'events'):
+            columns = {row[1] for row in connection.execute(f"PRAGMA table_info({table})")}
+            if 'case_id' not in columns:
+                connection.execute(f"ALTER TABLE {table} ADD COLUMN case_id TEXT NOT NULL DEFAULT '{DEFAULT_CASE_ID}'")
+        tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for kind in ('event', 'passage'):
+            if f"{kind}_search" in tables:
+                connection.execute(f"ALTER TABLE {kind}_search RENAME TO {search_table(kind, DEFAULT_CASE_ID)}")
+        connection.execute(
+            "INSERT OR IGNORE INTO cases (id, name, created_at) VALUES (?, 'Default case', ?)",
+            (DEFAULT_CASE_ID, datetime.now().isoformat())
+        )
+        self.create_case_tables(connection, DEFAULT_CASE_ID)
+
+    def create_case_tables(self, connection, case_id):
+        for kind in ('event', 'passage'):
+            connection.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {search_table(kind, case_id)} USING fts5 (content)")
+
+    def create_case(self, name, description=""):
+        case_id = uuid.uuid4().hex[:12]
+        created_at = datetime.now().isoformat()
+        with self.connection() as connection:
+            connection.execute(
+                "INSERT INTO cases (id, name, description, created_at) VALUES (?, ?, ?, ?)",
+                (case_id, name, description, created_at)
+            )
+            self.create_case_tables(connection, case_id)
+        return self.get_case(case_id)
+
+    def get_cases(self):
+        """Every case with its document and timeline event counts, oldest first"""
+        rows = self.connection().execute(CASE_QUERY + "ORDER BY c.created_at, c.id")
+        return [case_from_row(row) for row in rows]
+
+    def get_case(self, case_id):
+        """One case with its counts, None when it does not exist"""
+        row = self.connection().execute(CASE_QUERY + "WHERE c.id = ?", (case_id,)).fetchone()
+        return case_from_row(row) if row else None
+
+    def case_exists(self, case_id):
+        if not case_id or not CASE_ID_PATTERN.fullmatch(case_id):
+            return False
+        return self.connection().execute("SELECT 1 FROM cases WHERE id = ?", (case_id,)).fetchone() is not None
+
+    def add_document(self, document, events, index=None, deduplicator=None):
+        """
+        Store a document, its text and its events in one transaction.
+        index holds the retrieval entries from services.retrieval.build_index: search text per
+        event, passages, and optionally their embedding vectors.
+        With a deduplicator (services.dedup), an event matching a stored event on the same date
+        is kept as its duplicate, and the stored event lists this document in its documentIds.
+        Everything goes to the case in document["caseId"], the default case without one.
+        document["extractionVersion"] records which extraction produced the events, leave it
+        out when the LLM stage failed so the document is re-extracted in the background.
+        """
+        case_id = document.get("caseId", DEFAULT_CASE_ID)
+        with self.connection() as connection:
+            connection.execute(
+                "INSERT INTO documents (id, case_id, name, path, type, hash, upload_date) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (document["id"], case_id, document["name"], document["path"], document["type"],
+                 document.get("hash"), document["uploadDate"])
+            )
+            connection.execute(
+                "INSERT INTO document_texts (document_id, text) VALUES (?, ?)",
+                (document["id"], document["text"])
+            )
+            version = document.get("extractionVersion")
+            connection.execute(
+                "INSERT INTO extractions (document_id, version, extracted_at) VALUES (?, ?, ?)",
+                (document["id"], version, datetime.now().isoformat() if version else None)
+            )
+            event_seqs = self.insert_events(connection, case_id, document["id"], document["name"], events, deduplicator)
+            if index:
+                self.add_index_entries(connection, case_id, document["id"], event_seqs, index)
+
+    def insert_events(self, connection, case_id, document_id, document_name, events, deduplicator):
+        """Insert the events of a document, merging them into matching events of the case. Returns their seqs."""
+        event_seqs = []
+        merged = 0
+        for event in events:
+            if "dateKey" not in event:
+                event = normalize_event_date(event)
+            event = {**event, "documentIds": [document_id]}
+
+            signature = None
+            duplicate_of = None
+            # Undated events share one key, that is no evidence of being the same event
+            if deduplicator and event["datePrecision"] is not None:
+                signature = deduplicator.signature(event)
+                duplicate_of = deduplicator.best_match(
+                    signature, self.duplicate_candidates(connection, case_id, document_id, event["dateKey"], deduplicator)
+                )
+
+            cursor = connection.execute(
+                "INSERT INTO events (id, document_id, case_id, date, date_key, date_precision, duplicate_of, signature, payload) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (event["id"], document_id, case_id, str(event.get("date", "")), event["dateKey"], event["datePrecision"],
+                 duplicate_of, signature, json.dumps(event))
+            )
+            event_seqs.append(cursor.lastrowid)
+            if duplicate_of is not None:
+                self.refresh_sources(connection, duplicate_of)
+                merged += 1
+
+        if merged:
+            log_message("Merged %s events of %s into events of other documents", merged, document_name)
+        return event_seqs
+
+    def duplicate_candidates(self, connection, case_id, document_id, date_key, deduplicator):
+        """
+        (seq, signature) of a case's timeline events on a date from other documents than document_id,
+        two events of one document are two events. Computes the signatures stored events lack.
+        """
+        candidates = []
+        rows = connection.execute(
+            "SELECT seq, signature, payload FROM events "
+            "WHERE case_id = ? AND date_key = ? AND duplicate_of IS NULL AND document_id != ?",
+            (case_id, date_key, document_id)
+        ).fetchall()
+        for seq, signature, payload in rows:
+            if signature is None:
+                signature = deduplicator.signature(json.loads(payload))
+                connection.execute("UPDATE events SET signature = ? WHERE seq = ?", (signature, seq))
+            candidates.append((seq, signature))
+        return candidates
+
+    def refresh_sources(self, connection, seq, excluded_document_id=None):
+        """Set documentIds of a timeline event to its own document and those of its duplicates"""
+        rows = connection.execute(
+            "SELECT document_id FROM events WHERE (seq = ? OR duplicate_of = ?) AND document_id IS NOT ? "
+            "ORDER BY duplicate_of IS NOT NULL, seq",
+            (seq, seq, excluded_document_id)
+        ).fetchall()
+        document_ids = list(dict.fromkeys(row[0] for row in rows))
+        connection.execute(
+            "UPDATE events SET payload = json_set(payload, '$.documentIds', json(?)) WHERE seq = ?",
+            (json.dumps(document_ids), seq)
+        )
+
+    def add_index_entries(self, connection, case_id, document_id, event_seqs, index):
+        event_search = search_table('event', case_id)
+        passage_search = search_table('passage', case_id)
+        event_vectors = index.get("eventVectors") or [None] * len(event_seqs)
+        for seq, content, vector in zip(event_seqs, index["events"], event_vectors):
+            connection.execute(f"INSERT INTO {event_search} (rowid, content) VALUES (?, ?)", (seq, content))
+            if vector is not None:
+                connection.execute("INSERT INTO embeddings (kind, ref, vector) VALUES ('event', ?, ?)", (seq, vector))
+
+        passage_vectors = index.get("passageVectors") or [None] * len(index["passages"])
+        for content, vector in zip(index["passages"], passage_vectors):
+            cursor = connection.execute(
+                "INSERT INTO passages (document_id, content) VALUES (?, ?)", (document_id, content)
+            )
+            connection.execute(f"INSERT INTO {passage_search} (rowid, content) VALUES (?, ?)", (cursor.lastrowid, content))
+            if vector is not None:
+                connection.execute("INSERT INTO embeddings (kind, ref, vector) VALUES ('passage', ?, ?)", (cursor.lastrowid, vector))
+
+    def remove_events(self, connection, case_id, document_id):
+        """Delete the events of a document with their index entries, handing merged events over to other documents"""
+        # Events of other documents that were merged into this document's events take their place
+        canonical_seqs = [row[0] for row in connection.execute(
+            "SELECT seq FROM events WHERE document_id = ? AND duplicate_of IS NULL", (document_id,)
+        )]
+        for seq in canonical_seqs:
+            row = connection.execute(
+                "SELECT MIN(seq) FROM events WHERE duplicate_of = ? AND document_id != ?", (seq, document_id)
+            ).fetchone()
+            if row[0] is None:
+                continue
+            connection.execute("UPDATE events SET duplicate_of = NULL WHERE seq = ?", (row[0],))
+            connection.execute(
+                "UPDATE events SET duplicate_of = ? WHERE duplicate_of = ? AND document_id != ?",
+                (row[0], seq, document_id)
+            )
+            self.refresh_sources(connection, row[0], document_id)
+        # Events this document's events were merged into no longer list it
+        merged_into = [row[0] for row in connection.execute(
+            "SELECT DISTINCT duplicate_of FROM events WHERE document_id = ? AND duplicate_of IS NOT NULL", (document_id,)
+        )]
+        for seq in merged_into:
+            self.refresh_sources(connection, seq, document_id)
+
+        connection.execute(
+            f"DELETE FROM {search_table('event', case_id)} WHERE rowid IN (SELECT seq FROM events WHERE document_id = ?)",
+            (document_id,)
+        )
+        connection.execute(
+            "DELETE FROM embeddings WHERE kind = 'event' AND ref IN (SELECT seq FROM events WHERE document_id = ?)",
+            (document_id,)
+        )
+        connection.execute("DELETE FROM events WHERE document_id = ?", (document_id,))
+
+    def delete_document(self, document_id):
+        """Remove a document with its text, events and index entries, returns whether it existed"""
+        with self.connection() as connection:
+            row = connection.execute("SELECT case_id FROM documents WHERE id = ?", (document_id,)).fetchone()
+            if not row:
+                return False
+            case_id = row[0]
+            self.remove_events(connection, case_id, document_id)
+            connection.execute(
+                f"DELETE FROM {search_table('passage', case_id)} WHERE rowid IN (SELECT id FROM passages WHERE document_id = ?)",
+                (document_id,)
+            )
+            connection.execute(
+                "DELETE FROM embeddings WHERE kind = 'passage' AND ref IN (SELECT id FROM passages WHERE document_id = ?)",
+                (document_id,)
+            )
+            cursor = connection.execute("DELETE FROM documents WHERE id = ?", (document_id,))
+            return cursor.rowcount > 0
+
+    def claim_stale_extraction(self, version, lease_seconds):
+        """
+        Take the oldest document whose events were not extracted with version, or whose
+        holder has not finished it within lease_seconds. Returns the document with its text,
+        None when there is nothing to do or another worker is re-extracting a document:
+        one at a time across all processes, so the llama server stays free for chat.
+        """
+        now = time.time()
+        cutoff = now - lease_seconds
+        with self.connection() as connection:
+            busy = connection.execute(
+                "SELECT 1 FROM extractions WHERE claimed_at >= ? LIMIT 1", (cutoff,)
+            ).fetchone()
+            if busy:
+                return None
+            row = connection.execute(
+                f"SELECT {DOCUMENT_COLUMNS} FROM documents d LEFT JOIN extractions x ON x.document_id = d.id "
+                "WHERE (x.version IS NULL OR x.version != ?) AND (x.failed_version IS NULL OR x.failed_version != ?) "
+                "ORDER BY d.upload_date, d.id LIMIT 1",
+                (version, version)
+            ).fetchone()
+            if not row:
+                return None
+            # Guarded again in the statement itself, another process may have claimed something meanwhile
+            cursor = connection.execute(
+                "INSERT INTO extractions (document_id, claimed_at) SELECT ?, ? "
+                "WHERE NOT EXISTS (SELECT 1 FROM extractions WHERE claimed_at >= ?) "
+                "ON CONFLICT (document_id) DO UPDATE SET claimed_at = excluded.claimed_at",
+                (row[0], now, cutoff)
+            )
+            if cursor.rowcount == 0:
+                return None
+        return document_from_row(row, self.get_document_text(row[0], row[6]))
+
+    def replace_events(self, document_id, events, index, deduplicator, version):
+        """
+        Swap the events of a stored document for those of a new extraction, keeping its text
+        and passages, and record version as its extraction. Returns whether the document exists.
+        """
+        with self.connection() as connection:
+            row = connection.execute("SELECT case_id, name FROM documents WHERE id = ?", (document_id,)).fetchone()
+            if not row:
+                return False
+            case_id, name = row
+            self.remove_events(connection, case_id, document_id)
+            event_seqs = self.insert_events(connection, case_id, document_id, name, events, deduplicator)
+            self.add_index_entries(connection, case_id, document_id, event_seqs, index)
+            connection.execute(
+                "UPDATE extractions SET version = ?, extracted_at = ?, failed_version = NULL, error = NULL, claimed_at = NULL "
+                "WHERE document_id = ?",
+                (version, datetime.now().isoformat(), document_id)
+            )
+        return True
+
+    def fail_extraction(self, document_id, version, error):
+        """Keep the stored events and skip the document until the extraction version changes again"""
+        with self.connection() as connection:
+            connection.execute(
+                "UPDATE extractions SET failed_version = ?, error = ?, claimed_at = NULL WHERE document_id = ?",
+                (version, error, document_id)
+            )
+
+    def release_extraction(self, document_id):
+        """Give back a claimed document without recording anything, it is taken again later"""
+        with self.connection() as connection:
+            connection.execute("UPDATE extractions SET claimed_at = NULL WHERE document_id = ?", (document_id,))
+
+    def extraction_summary(self, version):
+        """Document counts by extraction state against version"""
+        row = self.connection().execute(
+            "SELECT COUNT(*), "
+            "COALESCE(SUM(x.version = ?), 0), "
+            "COALESCE(SUM(x.failed_version = ? AND x.version IS NOT ?), 0), "
+            "COALESCE(SUM(x.claimed_at IS NOT NULL), 0) "
+            "FROM documents d LEFT JOIN extractions x ON x.document_id = d.id",
+            (version, version, version)
+        ).fetchone()
+        return {
+            "version": version,
+            "documents": row[0],
+            "current": row[1],
+            "stale": row[0] - row[1] - row[2],
+            "failed": row[2],
+            "running": row[3]
+        }
+
+    def acquire_blob(self, content_hash, path, size):
+        """Count one more user of a blob, returns the path it is stored at"""
+        with self.connection() as connection:
+            row = connection.execute(
+                "INSERT INTO blobs (hash, path, size, ref_count) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT (hash) DO UPDATE SET ref_count = ref_count + 1 RETURNING path",
+                (content_hash, path, size)
+            ).fetchone()
+            return row[0]
+
+    def release_blob(self, content_hash, remove_file):
+        """
+        Count one user less of a blob. remove_file(path) is called for the last one,
+        inside the transaction, so a concurrent acquire either sees the blob gone or
+        keeps it alive.
+        """
+        connection = self.connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "UPDATE blobs SET ref_count = ref_count - 1 WHERE hash = ? RETURNING path, ref_count", (content_hash,)
+            ).fetchone()
+            if row and row[1] <= 0:
+                connection.execute("DELETE FROM blobs WHERE hash = ?", (content_hash,))
+                try:
+                    remove_file(row[0])
+                except FileNotFoundError:
+                    pass
+
+    def get_documents(self, case_id, with_text=True):
+        if with_text:
+            rows = self.connection().execute(
+                f"SELECT {DOCUMENT_COLUMNS}, t.text "
+                "FROM documents d LEFT JOIN document_texts t ON t.document_id = d.id "
+                "WHERE d.case_id = ? ORDER BY d.upload_date, d.id",
+                (case_id,)
+            )
+            return [document_from_row(row, row[7]) for row in rows]
+        rows = self.connection().execute(
+            f"SELECT {DOCUMENT_COLUMNS} FROM documents d WHERE d.case_id = ? ORDER BY d.upload_date, d.id", (case_id,)
+        )
+        return [document_from_row(row) for row in rows]
+
+    def get_document(self, document_id, with_text=True, case_id=None):
+        """A document, None when there is no such document or it belongs to another case than case_id"""
+        connection = self.connection()
+        row = connection.execute(f"SELECT {DOCUMENT_COLUMNS} FROM documents d WHERE d.id = ?", (document_id,)).fetchone()
+        if not row or (case_id is not None and row[6] != case_id):
+            return None
+        text = None
+        if with_text:
+            text_row = connection.execute("SELECT text FROM document_texts WHERE document_id = ?", (document_id,)).fetchone()
+            text = text_row[0] if text_row else ""
+        return document_from_row(row, text)
+
+    def get_document_text(self, document_id, case_id):
+        """Extracted text of a document, None when the case has no such document"""
+        row = self.connection().execute(
+            "SELECT COALESCE(t.text, '') FROM documents d LEFT JOIN document_texts t ON t.document_id = d.id "
+            "WHERE d.id = ? AND d.case_id = ?",
+            (document_id, case_id)
+        ).fetchone()
+        return row[0] if row else None
+
+    def get_documents_by_ids(self, document_ids, with_text=True):
+        """Documents in the order of document_ids, missing ids are skipped"""
+        documents = (self.get_document(document_id, with_text) for document_id in document_ids)
+        return [document for document in documents if document]
+
+    def get_timeline_events(self, case_id, limit=-1):
+        rows = self.connection().execute(
+            "SELECT payload FROM events WHERE case_id = ? AND duplicate_of IS NULL ORDER BY date_key, seq LIMIT ?",
+            (case_id, limit)
+        )
+        return [json.loads(row[0]) for row in rows]
+
+    def query_events(self, case_id, key_from=None, key_to=None, limit=100, after=None):
+        """
+        Up to limit events of a case with key_from <= date_key <= key_to in timeline order,
+        walking the (case_id, date_key, seq) index. after is the (date_key, seq) of the last event of the previous
+        page. Returns the events and the (date_key, seq) to continue after, or None at the end.
+        """
+        conditions = ["case_id = ?", "duplicate_of IS NULL"]
+        params = [case_id]
+        if key_from is not None:
+            conditions.append("date_key >= ?")
+            params.append(key_from)
+        if key_to is not None:
+            conditions.append("date_key <= ?")
+            params.append(key_to)
+        if after is not None:
+            conditions.append("(date_key > ? OR (date_key = ? AND seq > ?))")
+            params.extend([after[0], after[0], after[1]])
+        where = f"WHERE {' AND '.join(conditions)}"
+
+        rows = self.connection().execute(
+            f"SELECT date_key, seq, payload FROM events {where} ORDER BY date_key, seq LIMIT ?", (*params, limit + 1)
+        ).fetchall()
+        events = [json.loads(row[2]) for row in rows[:limit]]
+        next_after = (rows[limit - 1][0], rows[limit - 1][1]) if len(rows) > limit else None
+        return events, next_after
+
+    def count_events_by_period(self, case_id, divisor):
+        """
+        (period key, event count) of a case in timeline order, grouping on date_key // divisor:
+        10000 groups by year, 100 by month. Dates without a year come last with year 0, events
+        without a date are left out.
+        """
+        rows = self.connection().execute(
+            "SELECT date_key >= ? AS no_year, (date_key % ?) / ? AS period, COUNT(*) FROM events "
+            "WHERE case_id = ? AND date_key < ? AND duplicate_of IS NULL "
+            "GROUP BY no_year, period ORDER BY no_year, period",
+            (NO_YEAR_SORT_KEY, NO_YEAR_SORT_KEY, divisor, case_id, UNDATED_SORT_KEY)
+        )
+        return [(row[1], row[2]) for row in rows]
+
+    def timeline_version(self, case_id):
+        """Changes whenever events are added to or removed from a case"""
+        row = self.connection().execute(
+            "SELECT COUNT(*), COALESCE(MAX(seq), 0) FROM events WHERE case_id = ?", (case_id,)
+        ).fetchone()
+        return f"{row[0]}:{row[1]}"
+
+    def search_events(self, case_id, match, limit):
+        """(seq, event, bm25 score) of a case's best matching events, lower scores are better"""
+        table = search_table('event', case_id)
+        rows = self.connection().execute(
+            f"SELECT e.seq, e.payload, bm25({table}) AS score FROM {table} "
+            f"JOIN events e ON e.seq = {table}.rowid "
+            f"WHERE {table} MATCH ? AND e.duplicate_of IS NULL ORDER BY score LIMIT ?",
+            (match, limit)
+        )
+        return [(row[0], json.loads(row[1]), row[2]) for row in rows]
+
+    def search_passages(self, case_id, match, limit):
+        """(id, passage, bm25 score) of a case's best matching passages, lower scores are better"""
+        table = search_table('passage', case_id)
+        rows = self.connection().execute(
+            f"SELECT p.id, p.document_id, d.name, p.content, bm25({table}) AS score FROM {table} "
+            f"JOIN passages p ON p.id = {table}.rowid "
+            "JOIN documents d ON d.id = p.document_id "
+            f"WHERE {table} MATCH ? ORDER BY score LIMIT ?",
+            (match, limit)
+        )
+        return [(row[0], {"documentId": row[1], "document": row[2], "content": row[3]}, row[4]) for row in rows]
+
+    def get_embeddings(self, kind, refs):
+        if not refs:
+            return {}
+        rows = self.connection().execute(
+            f"SELECT ref, vector FROM embeddings WHERE kind = ? AND ref IN ({', '.join('?' * len(refs))})",
+            (kind, *refs)
+        )
+        return {row[0]: row[1] for row in rows}
 
 # Create a singleton instance
 data = Data()
@@ -0,0 +1,184 @@
+"""
+Ingestion job store for the application
+This module tracks background upload jobs and the stage each document is in.
+Jobs live in the SQLite database, so every worker process sees jobs started by the others.
+"""
+import json
+import uuid
+from datetime import datetime
+
+from models.data import data, DEFAULT_CASE_ID
+
+# Stages a document moves through while its job is running
+STAGE_QUEUED = "queued"
+STAGE_EXTRACTING_TEXT = "extracting_text"
+STAGE_EXTRACTING_EVENTS = "extracting_events"
+STAGE_DONE = "done"
+STAGE_FAILED = "failed"
+
+# Overall job statuses
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    case_id TEXT NOT NULL DEFAULT 'default',
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+
+-- Documents of a job in upload order, events holds the events extracted from each
+CREATE TABLE IF NOT EXISTS job_documents (
+    job_id TEXT NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    document_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    hash TEXT,
+    stage TEXT NOT NULL,
+    error TEXT,
+    event_count INTEGER NOT NULL DEFAULT 0,
+    events TEXT,
+    PRIMARY KEY (job_id, position)
+);
+
+CREATE INDEX IF NOT EXISTS job_documents_document_id ON job_documents (document_id);
+"""
+
+def job_document_from_row(row):
+    return {
+        "id": row[0],
+        "name": row[1],
+        "type": row[2],
+        "stage": row[3],
+        "error": row[4],
+        "eventCount": row[5]
+    }
+
+class Jobs:
+    def __init__(self):
+        with data.connection() as connection:
+            connection.executescript(SCHEMA)
+            # Jobs from before there were cases uploaded to the default case
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(jobs)")}
+            if 'case_id' not in columns:
+                connection.execute(f"ALTER TABLE jobs ADD COLUMN case_id TEXT NOT NULL DEFAULT '{DEFAULT_CASE_ID}'")
+
+    def touch(self, connection, job_id):
+        connection.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (datetime.now().isoformat(), job_id))
+
+    def create_job(self, documents, case_id):
+        job_id = uuid.uuid4().hex
+        now = datetime.now().isoformat()
+        with data.connection() as connection:
+            connection.execute(
+                "INSERT INTO jobs (id, case_id, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, case_id, STATUS_QUEUED, now, now)
+            )
+            connection.executemany(
+                "INSERT INTO job_documents (job_id, position, document_id, name, type, hash, stage) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (job_id, position, document["id"], document["name"], document["type"], document.get("hash"), STAGE_QUEUED)
+                    for position, document in enumerate(documents)
+                ]
+            )
+        return self.get_job(job_id)
+
+    def get_job(self, job_id):
+        """Job status with its documents, without the extracted events"""
+        connection = data.connection()
+        row = connection.execute(
+            "SELECT id, status, created_at, updated_at, case_id FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if not row:
+            return None
+        documents = connection.execute(
+            "SELECT document_id, name, type, stage, error, event_count FROM job_documents "
+            "WHERE job_id = ? ORDER BY position",
+            (job_id,)
+        ).fetchall()
+        return {
+            "id": row[0],
+            "caseId": row[4],
+            "status": row[1],
+            "createdAt": row[2],
+            "updatedAt": row[3],
+            "documents": [job_document_from_row(document) for document in documents]
+        }
+
+    def set_status(self, job_id, status):
+        with data.connection() as connection:
+            connection.execute("UPDATE jobs SET status = ? WHERE id = ?", (status, job_id))
+            self.touch(connection, job_id)
+
+    def set_stage(self, job_id, document_id, stage, error=None):
+        with data.connection() as connection:
+            connection.execute(
+                "UPDATE job_documents SET stage = ?, error = ? WHERE job_id = ? AND document_id = ?",
+                (stage, error, job_id, document_id)
+            )
+            self.touch(connection, job_id)
+
+    def add_events(self, job_id, document_id, events):
+        with data.connection() as connection:
+            connection.execute(
+                "UPDATE job_documents SET events = ?, event_count = ? WHERE job_id = ? AND document_id = ?",
+                (json.dumps(events), len(events), job_id, document_id)
+            )
+            self.touch(connection, job_id)
+
+    def events(self, job_id):
+        """Events of a job in the order its documents were uploaded"""
+        rows = data.connection().execute(
+            "SELECT events FROM job_documents WHERE job_id = ? AND events IS NOT NULL ORDER BY position", (job_id,)
+        )
+        return [event for row in rows for event in json.loads(row[0])]
+
+    def summary(self, job_id):
+        """Job status without the extracted events"""
+        job = self.get_job(job_id)
+        if not job:
+            return None
+        return {**job, "eventCount": sum(document["eventCount"] for document in job["documents"])}
+
+    def fail_interrupted(self):
+        """
+        Mark jobs left queued or running by a stopped server as failed. Returns the content
+        hashes of their unfinished documents, whose blob references were never released.
+        Only safe before any worker has started taking uploads.
+        """
+        now = datetime.now().isoformat()
+        with data.connection() as connection:
+            # Stored before the server stopped, only the stage update was lost
+            connection.execute(
+                "UPDATE job_documents SET stage = ? WHERE stage NOT IN (?, ?) AND document_id IN (SELECT id FROM documents) "
+                "AND job_id IN (SELECT id FROM jobs WHERE status IN (?, ?))",
+                (STAGE_DONE, STAGE_DONE, STAGE_FAILED, STATUS_QUEUED, STATUS_RUNNING)
+            )
+            rows = connection.execute(
+                "SELECT d.hash FROM job_documents d JOIN jobs j ON j.id = d.job_id "
+                "WHERE j.status IN (?, ?) AND d.stage NOT IN (?, ?) AND d.hash IS NOT NULL",
+                (STATUS_QUEUED, STATUS_RUNNING, STAGE_DONE, STAGE_FAILED)
+            ).fetchall()
+            connection.execute(
+                "UPDATE job_documents SET stage = ?, error = ? WHERE stage NOT IN (?, ?) AND job_id IN "
+                "(SELECT id FROM jobs WHERE status IN (?, ?))",
+                (STAGE_FAILED, "The server stopped before the document was processed",
+                 STAGE_DONE, STAGE_FAILED, STATUS_QUEUED, STATUS_RUNNING)
+            )
+            # Same rule as a finished job, failed only when none of its documents made it
+            connection.execute(
+                "UPDATE jobs SET updated_at = ?, status = CASE WHEN EXISTS "
+                "(SELECT 1 FROM job_documents d WHERE d.job_id = jobs.id AND d.stage = ?) THEN ? ELSE ? END "
+                "WHERE status IN (?, ?)",
+                (now, STAGE_DONE, STATUS_COMPLETED, STATUS_FAILED, STATUS_QUEUED, STATUS_RUNNING)
+            )
+        return [row[0] for row in rows]
+
+# Create a singleton instance
+jobs = Jobs()
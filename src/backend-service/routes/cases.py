@@ -0,0 +1,34 @@
+from flask import Blueprint, request, jsonify
+
+from models.data import data, DEFAULT_CASE_ID
+
+cases_bp = Blueprint('cases', __name__)
+
+class UnknownCaseError(LookupError):
+    pass
+
+def requested_case(values):
+    """The case named by caseId in values, the default case without one. Raises UnknownCaseError."""
+    case_id = (values or {}).get('caseId') or DEFAULT_CASE_ID
+    if not data.case_exists(case_id):
+        raise UnknownCaseError(f"Case {case_id} not found")
+    return case_id
+
+@cases_bp.route('/', methods=['GET'])
+def get_cases():
+    return jsonify(data.get_cases())
+
+@cases_bp.route('/', methods=['POST'])
+def create_case():
+    request_data = request.get_json(silent=True) or {}
+    name = str(request_data.get('name') or '').strip()
+    if not name:
+        return jsonify({"message": "No case name provided"}), 400
+    return jsonify(data.create_case(name, str(request_data.get('description') or ''))), 201
+
+@cases_bp.route('/<case_id>', methods=['GET'])
+def get_case(case_id):
+    case = data.get_case(case_id)
+    if not case:
+        return jsonify({"message": "Case not found"}), 404
+    return jsonify(case)
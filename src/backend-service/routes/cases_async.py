@@ -0,0 +1,29 @@
+"""
+The cases blueprint for the ASGI app, same routes and JSON as routes/cases.py.
+"""
+from quart import Blueprint, request, jsonify
+from quart.utils import run_sync
+
+from models.data import data
+
+cases_bp = Blueprint('cases', __name__)
+
+@cases_bp.route('/', methods=['GET'])
+def get_cases():
+    return jsonify(data.get_cases())
+
+@cases_bp.route('/', methods=['POST'])
+async def create_case():
+    request_data = await request.get_json(silent=True) or {}
+    name = str(request_data.get('name') or '').strip()
+    if not name:
+        return jsonify({"message": "No case name provided"}), 400
+    case = await run_sync(data.create_case)(name, str(request_data.get('description') or ''))
+    return jsonify(case), 201
+
+@cases_bp.route('/<case_id>', methods=['GET'])
+def get_case(case_id):
+    case = data.get_case(case_id)
+    if not case:
+        return jsonify({"message": "Case not found"}), 404
+    return jsonify(case)
@@ -1,11 +1,19 @@
 import json
 import os
-import requests
-from flask import Blueprint, request, jsonify
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from dotenv import load_dotenv
-from utils import log_message
+from utils import log_error, log_message, log_payload
 
 from models.data import data
+from routes.cases import UnknownCaseError, requested_case
+from services.http_client import llm_client
+from services.metrics import metrics
+from services.retrieval import CHAT_CONTEXT_TOKENS, retrieve_context
+from services.tokens import LLM_CONTEXT_SIZE, PROMPT_MARGIN_TOKENS, plan_request, token_counter
 
 if not os.environ.get('LLM_MODEL_PATH'):
     load_dotenv()
@@ -13,65 +21,274 @@ if not os.environ.get('LLM_MODEL_PATH'):
 chat_bp = Blueprint('chat', __name__)
 
 LLM_ENDPOINT = os.environ.get('LLM_ENDPOINT_PATH', "http://localhost:8080/answer")
+CHAT_RESPONSE_TOKENS = int(os.environ.get('CHAT_RESPONSE_TOKENS', '1024'))
+# A question whose prompt leaves less room than this for the answer is rejected
+CHAT_MIN_RESPONSE_TOKENS = 256
+# Budget of the timeline block shared by every question, see create_prompt_prefix
+CHAT_PREFIX_TOKENS = int(os.environ.get('CHAT_PREFIX_TOKENS', '2000'))
+CHAT_PREFIX_MAX_EVENTS = 500
+# Slots the llama server runs with (--parallel) that chat sessions are spread over, 0 lets the server pick
+LLM_CHAT_SLOTS = int(os.environ.get('LLM_CHAT_SLOTS', '0'))
+# Prompt prefixes of cases nobody asked about for this long are dropped from memory
+CASE_IDLE_SECONDS = float(os.environ.get('CASE_IDLE_SECONDS', '900'))
+CHAT_PREFIX_MAX_CASES = int(os.environ.get('CHAT_PREFIX_MAX_CASES', '64'))
+
+# Case id to its rendered prefix, least recently used first
+prefix_cache = OrderedDict()
+prefix_lock = threading.Lock()
+
+def format_event(event):
+    return f"""Date: {event.get('date', '')}
+      Summary: {event.get('title', '')}. {event.get('description', '')}
+      Document: {event.get('document', '')}
+      Context: {event.get('context', '')}
+      ---"""
+
+def format_passage(passage):
+    return f"""Document: {passage['document']}
+      Excerpt: {passage['content']}
+      ---"""
 
 def create_timeline_context(events):
     if not events or len(events) == 0:
         return "No timeline events available."
     
-    return "\n".join([
-        f"""Date: {event.get('date', '')}
-      Summary: {event.get('summary', '')}
-      Document: {event.get('document', '')}
-      Context: {event.get('context', '')}
-      ---"""
-        for event in events
-    ])
+    return "\n".join([format_event(event) for event in events])
 
-@chat_bp.route('/receive', methods=['POST'])
-def process_chat():
-    try:
-        request_data = request.get_json()
-        message = request_data.get('message')
-        
-        if not message:
-            return jsonify({"message": "No message provided"}), 400
-        
-        timeline_context = create_timeline_context(data.timeline_events)
-        log_message(timeline_context, prefix="Timeline Context")
-        
-        prompt = f"""
+def create_passage_context(passages):
+    if not passages:
+        return "No document excerpts available."
+
+    return "\n".join([format_passage(passage) for passage in passages])
+
+def chat_prompt_prefix(timeline_context):
+    """Everything before the question, identical between requests while the timeline is unchanged"""
+    return f"""
         [INST]
-        You are an assistant for a legal case. You are to answer questions based on just the relevant text extracted from various documents. This is the text:
+        You are an assistant for a legal case. You are to answer questions based on just the relevant text extracted from various documents.
+        If the question falls out of the scope of the text below, just say that you cannot answer that question.
+        Be concise, accurate, and helpful. Cite the document names when providing information.
+        This is the timeline of the case:
         
         {timeline_context}
+        """
+
+def chat_prompt_suffix(timeline_context, passage_context, message):
+    return f"""
+        These are further events relevant to the question:
+
+        {timeline_context}
+
+        These are excerpts from the documents:
+
+        {passage_context}
         
-        If the question falls out of the scope of the text above, just say that you cannot answer that question.
-        Be concise, accurate, and helpful. Cite the document names when providing information.
         This is the question from the user:
 
         {message}
         [/INST]
         """
+
+def evict_idle_prefixes(now):
+    """Drop the prefixes of idle cases, and of the least recently used ones beyond CHAT_PREFIX_MAX_CASES. Call with prefix_lock held."""
+    while prefix_cache:
+        case_id, entry = next(iter(prefix_cache.items()))
+        if now - entry["usedAt"] < CASE_IDLE_SECONDS and len(prefix_cache) <= CHAT_PREFIX_MAX_CASES:
+            break
+        del prefix_cache[case_id]
+
+def create_prompt_prefix(case_id):
+    """
+    (prefix, prefix tokens, ids of the events in it) for the current timeline of a case.
+    The earliest events up to CHAT_PREFIX_TOKENS are rendered once per timeline version,
+    so the llama server can keep the prefix in its slot's KV cache across questions.
+    """
+    version = data.timeline_version(case_id)
+    now = time.monotonic()
+    with prefix_lock:
+        entry = prefix_cache.get(case_id)
+        if entry and entry["version"] == version:
+            entry["usedAt"] = now
+            prefix_cache.move_to_end(case_id)
+            evict_idle_prefixes(now)
+            return entry["prefix"], entry["tokens"], entry["eventIds"]
+
+    events = data.get_timeline_events(case_id, CHAT_PREFIX_MAX_EVENTS)
+    costs = token_counter.count_many([format_event(event) for event in events])
+    selected = []
+    used = 0
+    for event, cost in zip(events, costs):
+        if used + cost > CHAT_PREFIX_TOKENS:
+            break
+        selected.append(event)
+        used += cost
+
+    prefix = chat_prompt_prefix(create_timeline_context(selected))
+    prefix_tokens = token_counter.count(prefix)
+    event_ids = {event['id'] for event in selected}
+    with prefix_lock:
+        prefix_cache[case_id] = {
+            "version": version, "prefix": prefix, "tokens": prefix_tokens, "eventIds": event_ids, "usedAt": now
+        }
+        prefix_cache.move_to_end(case_id)
+        evict_idle_prefixes(now)
+    return prefix, prefix_tokens, event_ids
+
+def create_chat_prompt(message, case_id):
+    """The prompt for a question about a case and the n_predict that fits next to it in the context"""
+    prefix, prefix_tokens, prefix_event_ids = create_prompt_prefix(case_id)
+
+    # Whatever the prefix and the question leave of the context, minus the answer, goes to retrieval
+    template_tokens = prefix_tokens + token_counter.count(chat_prompt_suffix("", "", message))
+    context_budget = min(
+        CHAT_CONTEXT_TOKENS,
+        LLM_CONTEXT_SIZE - template_tokens - CHAT_RESPONSE_TOKENS - PROMPT_MARGIN_TOKENS
+    )
+
+    # Only the events and passages relevant to the question, so the prompt stays small as the case grows
+    events, passages = retrieve_context(
+        message, case_id, max(context_budget, 0), format_event, format_passage, exclude_event_ids=prefix_event_ids
+    )
+    timeline_context = create_timeline_context(events) if events else "No further events."
+    passage_context = create_passage_context(passages)
+    log_payload("chat.timeline_context", timeline_context)
+
+    prompt = prefix + chat_prompt_suffix(timeline_context, passage_context, message)
+    n_predict = plan_request(
+        token_counter.count(prompt), CHAT_RESPONSE_TOKENS,
+        min_output_tokens=min(CHAT_MIN_RESPONSE_TOKENS, CHAT_RESPONSE_TOKENS), label="chat"
+    )
+    return prompt, n_predict
+
+def chat_slot(session_id):
+    """Pin a chat session to one llama server slot, so its cached prefix is there on the next question"""
+    if not session_id or LLM_CHAT_SLOTS <= 0:
+        return -1
+    return int(hashlib.sha1(str(session_id).encode('utf-8')).hexdigest(), 16) % LLM_CHAT_SLOTS
+
+def completion_request(prompt, n_predict, session_id, stream=False):
+    body = {
+        "prompt": prompt,
+        "n_predict": n_predict,
+        "cache_prompt": True,
+        "id_slot": chat_slot(session_id)
+    }
+    if stream:
+        body["stream"] = True
+    return body
+
+def stream_chunk(line):
+    """The JSON chunk of a line of the llama server's event stream, None for blank and comment lines"""
+    if not line or not line.startswith('data: '):
+        return None
+    return json.loads(line[len('data: '):])
+
+def server_sent_event(payload):
+    return f"data: {json.dumps(payload)}\n\n"
+
+def observe_stream_chunk(chunk, started, first_token):
+    """Record the time to the first token and, from the final chunk, the llama server's timings. Returns first_token."""
+    if chunk.get('content') and not first_token:
+        metrics.observe("chronolaw_stage_duration_seconds", time.perf_counter() - started, stage="chat_first_token")
+        first_token = True
+    if chunk.get('stop'):
+        metrics.observe_llm_timings("chat", chunk)
+    return first_token
+
+@chat_bp.route('/receive', methods=['POST'])
+def process_chat():
+    """Answers a question about the case in the body's caseId, the default case without one"""
+    try:
+        request_data = request.get_json()
+        message = request_data.get('message')
+        
+        if not message:
+            return jsonify({"message": "No message provided"}), 400
+        case_id = requested_case(request_data)
         
-        response = requests.post(
-            LLM_ENDPOINT,
-            headers={'Content-Type': 'application/json'},
-            json={
-                "prompt": prompt,
-                "n_predict": int(5000)
-            }
-        )
+        with metrics.timer("chat_prompt"):
+            prompt, n_predict = create_chat_prompt(message, case_id)
+        
+        with metrics.timer("chat_completion"):
+            response = llm_client.post(
+                LLM_ENDPOINT,
+                headers={'Content-Type': 'application/json'},
+                json=completion_request(prompt, n_predict, request_data.get('sessionId'))
+            )
         
         try:
             response_json = json.loads(response.text)
-            log_message(response_json['content'], prefix="Chat Reponse")
+            log_payload("chat.response", response_json['content'])
+            metrics.observe_llm_timings("chat", response_json)
             response_text = response_json['content']
             return jsonify({"response": response_text})
         except Exception as e:
-            log_message(f'Error parsing LLM response: {e}')
-            log_message(f'Raw response: {response.text}')
+            log_error("Error parsing LLM response: %s", e)
+            metrics.increment("chronolaw_parse_failures_total", kind="chat")
+            log_payload("chat.raw_response", response.text)
             raise e
     
+    except UnknownCaseError as e:
+        return jsonify({"message": str(e)}), 404
+    except Exception as e:
+        log_error("Error processing chat message: %s", e)
+        return jsonify({"message": "Error processing chat message", "error": str(e)}), 500
+
+@chat_bp.route('/receive/stream', methods=['POST'])
+def process_chat_stream():
+    """
+    Same as /receive, but relays tokens as server-sent events while the llama server produces them.
+    Each event is `{"content": "..."}`, the last one is `{"stop": true}` or `{"error": "..."}`.
+    """
+    request_data = request.get_json()
+    message = request_data.get('message') if request_data else None
+    
+    if not message:
+        return jsonify({"message": "No message provided"}), 400
+    
+    try:
+        case_id = requested_case(request_data)
+        with metrics.timer("chat_prompt"):
+            prompt, n_predict = create_chat_prompt(message, case_id)
+    except UnknownCaseError as e:
+        return jsonify({"message": str(e)}), 404
     except Exception as e:
-        print(f'Error processing chat message: {e}')
+        log_error("Error preparing chat message: %s", e)
         return jsonify({"message": "Error processing chat message", "error": str(e)}), 500
+
+    def generate():
+        started = time.perf_counter()
+        first_token = False
+        try:
+            with metrics.timer("chat_stream"), llm_client.stream(
+                LLM_ENDPOINT,
+                headers={'Content-Type': 'application/json'},
+                json=completion_request(prompt, n_predict, request_data.get('sessionId'), stream=True)
+            ) as response:
+                if response.status_code != 200:
+                    yield server_sent_event({"error": f"LLM service returned status code {response.status_code}"})
+                    return
+
+                for line in response.iter_lines(decode_unicode=True):
+                    chunk = stream_chunk(line)
+                    if chunk is None:
+                        continue
+                    first_token = observe_stream_chunk(chunk, started, first_token)
+                    if chunk.get('content'):
+                        yield server_sent_event({"content": chunk['content']})
+                    if chunk.get('stop'):
+                        break
+            yield server_sent_event({"stop": True})
+        except GeneratorExit:
+            # The browser went away, leaving the with block closes the upstream connection
+            log_message("Chat stream closed by the client, cancelling generation")
+            raise
+        except Exception as e:
+            log_error("Error streaming chat message: %s", e)
+            yield server_sent_event({"error": str(e)})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
@@ -0,0 +1,118 @@
+"""
+The chat blueprint for the ASGI app, same routes and JSON as routes/chat.py.
+Waiting on the llama server costs a coroutine, not a thread, so one process can hold
+hundreds of open chat streams. Building the prompt (SQLite and the tokenizer) runs
+on Quart's thread pool.
+"""
+import json
+import time
+import asyncio
+from quart import Blueprint, Response, request, jsonify
+from quart.utils import run_sync
+
+from routes.cases import UnknownCaseError, requested_case
+from routes.chat import (
+    LLM_ENDPOINT, completion_request, create_chat_prompt, observe_stream_chunk, server_sent_event, stream_chunk
+)
+from services.async_http_client import async_llm_client
+from services.metrics import metrics
+from utils import log_error, log_message, log_payload
+
+chat_bp = Blueprint('chat', __name__)
+
+@chat_bp.route('/receive', methods=['POST'])
+async def process_chat():
+    try:
+        request_data = await request.get_json()
+        message = request_data.get('message')
+
+        if not message:
+            return jsonify({"message": "No message provided"}), 400
+        case_id = await run_sync(requested_case)(request_data)
+
+        with metrics.timer("chat_prompt"):
+            prompt, n_predict = await run_sync(create_chat_prompt)(message, case_id)
+
+        with metrics.timer("chat_completion"):
+            response = await async_llm_client.post(
+                LLM_ENDPOINT,
+                headers={'Content-Type': 'application/json'},
+                json=completion_request(prompt, n_predict, request_data.get('sessionId'))
+            )
+
+        try:
+            response_json = json.loads(response.text)
+            log_payload("chat.response", response_json['content'])
+            metrics.observe_llm_timings("chat", response_json)
+            return jsonify({"response": response_json['content']})
+        except Exception as e:
+            log_error("Error parsing LLM response: %s", e)
+            metrics.increment("chronolaw_parse_failures_total", kind="chat")
+            log_payload("chat.raw_response", response.text)
+            raise e
+
+    except UnknownCaseError as e:
+        return jsonify({"message": str(e)}), 404
+    except Exception as e:
+        log_error("Error processing chat message: %s", e)
+        return jsonify({"message": "Error processing chat message", "error": str(e)}), 500
+
+@chat_bp.route('/receive/stream', methods=['POST'])
+async def process_chat_stream():
+    """Server-sent events as in routes/chat.py"""
+    request_data = await request.get_json()
+    message = request_data.get('message') if request_data else None
+
+    if not message:
+        return jsonify({"message": "No message provided"}), 400
+
+    try:
+        case_id = await run_sync(requested_case)(request_data)
+        with metrics.timer("chat_prompt"):
+            prompt, n_predict = await run_sync(create_chat_prompt)(message, case_id)
+    except UnknownCaseError as e:
+        return jsonify({"message": str(e)}), 404
+    except Exception as e:
+        log_error("Error preparing chat message: %s", e)
+        return jsonify({"message": "Error processing chat message", "error": str(e)}), 500
+
+    async def generate():
+        started = time.perf_counter()
+        first_token = False
+        try:
+            with metrics.timer("chat_stream"):
+                async with async_llm_client.stream(
+                    LLM_ENDPOINT,
+                    headers={'Content-Type': 'application/json'},
+                    json=completion_request(prompt, n_predict, request_data.get('sessionId'), stream=True)
+                ) as response:
+                    if response.status_code != 200:
+                        yield server_sent_event({"error": f"LLM service returned status code {response.status_code}"})
+                        return
+
+                    async for line in response.aiter_lines():
+                        chunk = stream_chunk(line)
+                        if chunk is None:
+                            continue
+                        first_token = observe_stream_chunk(chunk, started, first_token)
+                        if chunk.get('content'):
+                            yield server_sent_event({"content": chunk['content']})
+                        if chunk.get('stop'):
+                            break
+            yield server_sent_event({"stop": True})
+        except (asyncio.CancelledError, GeneratorExit):
+            # The browser went away, leaving the async with block closes the upstream connection
+            log_message("Chat stream closed by the client, cancelling generation")
+            raise
+        except Exception as e:
+            log_error("Error streaming chat message: %s", e)
+            yield server_sent_event({"error": str(e)})
+
+    response = Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Quart limits how long a response may take by default, an answer takes as long as the LLM needs
+    response.timeout = None
+    return response
@@ -1,194 +1,253 @@
 import os
 import time
+import uuid
 import json
-from datetime import datetime
-from flask import Blueprint, request, jsonify
+import base64
+from flask import Blueprint, Response, request, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
-import requests
-import pymupdf
-import docx2txt
 
 from models.data import data
-from utils import get_file_path, log_message, document_extraction_grammar, document_extraction_prompt
+from models.jobs import jobs
+from routes.cases import UnknownCaseError, requested_case
+from services.blob_store import blob_store
+from services.dates import date_range
+from services.extraction_cache import extraction_cache
+from services.metrics import metrics
+from services.ingestion import submit_job
 
 documents_bp = Blueprint('documents', __name__)
 
-UPLOAD_FOLDER = get_file_path('uploads')
 ALLOWED_EXTENSIONS = {'pdf', 'docx'}
-MAX_CONTENT_LENGTH = 10 * 1024 * 1024  # 10MB
-
-PDF_PARSER_ENDPOINT = os.environ.get('PDF_PARSER_ENDPOINT_PATH', 'http://localhost:8503/predict')
-LLM_ENDPOINT = os.environ.get('LLM_ENDPOINT_PATH', "http://localhost:8080/answer")
+# The blob's path on the server is left out, it only means something to the blob store
+DOCUMENT_FIELDS = ['id', 'caseId', 'name', 'type', 'hash', 'uploadDate']
+TIMELINE_PAGE_SIZE = 100
+TIMELINE_MAX_PAGE_SIZE = 1000
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def requested_fields(args):
+    """Fields named in ?fields=, all metadata fields by default. Raises ValueError for unknown fields."""
+    if not args.get('fields'):
+        return DOCUMENT_FIELDS
+    fields = [field.strip() for field in args['fields'].split(',') if field.strip()]
+    unknown = [field for field in fields if field not in DOCUMENT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}, text is served by /<id>/text")
+    return fields
+
+def project(document, fields):
+    return {field: document.get(field) for field in fields}
+
 def save_file(file):
     filename = secure_filename(file.filename)
-    document_id = str(int(time.time() * 1000))
-    file_path = os.path.join(UPLOAD_FOLDER, f"{document_id}-{filename}")
+    # Files of one upload are saved back to back, so the timestamp alone is not unique
+    document_id = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
     document_type = os.path.splitext(filename)[1].lower()
-    file.save(file_path)
-    
-    return document_id, filename, document_type, file_path
-
-def nougat_pdf_text_extraction(file_path, start_page=None, end_page=None):
-    with open(file_path, 'rb') as pdf_file:
-        files = {'file': pdf_file}
-        
-        data = {}
-        if start_page is not None:
-            data['start'] = start_page
-        if end_page is not None:
-            data['stop'] = end_page
-            
-        log_message(f"Sending PDF to Nougat service with params: {data}", prefix="Sending PDF")
-        response = requests.post(PDF_PARSER_ENDPOINT, files=files, data=data)
-        
-    if response.status_code != 200:
-        log_message(f"Error from nougat service: {response.text}")
-        raise Exception(f"Nougat service returned status code {response.status_code}")
+    # Already streamed to disk and hashed while the request was parsed, see UploadRequest
+    content_hash, file_path = blob_store.store(file.stream, document_type)
     
-    try:
-        result = response.json()
-        log_message(result, prefix="Parsed PDF")
-        if isinstance(result, dict) and 'text' in result:
-            text = result['text']
-        else:
-            text = str(result)
-    except ValueError:
-        text = response.text
-    
-    log_message(f"Extracted text length: {len(text)}")
-    return text
-
-def fallback_pdf_text_extraction(file_path):
-    reader = pymupdf.open(file_path)
-    text = ""
-    for page in reader:
-        text += page.get_text() + "\n"
-    log_message(text, prefix="pymupdf")
-    return text
-
-def extract_text_from_pdf(file_path):
-    try:
-        return nougat_pdf_text_extraction(file_path)
-    except Exception as e:
-        log_message(f"Error extracting text from PDF: {e}")
-        try:
-            log_message("Falling back to PyPDF2 for text extraction")
-            return fallback_pdf_text_extraction(file_path)
-        except Exception as fallback_error:
-            log_message(f"Fallback extraction also failed: {fallback_error}")
-            raise e
+    return document_id, filename, document_type, file_path, content_hash
 
-def extract_text_from_docx(file_path):
-    try:
-        text = docx2txt.process(file_path)
-        return text
-    except Exception as e:
-        log_message(f"Error extracting text from DOCX: {e}")
-        raise e
+@documents_bp.errorhandler(RequestEntityTooLarge)
+def file_too_large(e):
+    return jsonify({"message": e.description}), 413
+
+@documents_bp.errorhandler(UnknownCaseError)
+def unknown_case(e):
+    return jsonify({"message": str(e)}), 404
+
+def queue_uploads(files, case_id):
+    """(body, status code) for an upload of files to a case, saving them and queueing a job for the supported ones"""
+    if not files or len(files) == 0:
+        return {"message": "No files uploaded"}, 400
 
-def extract_events_from_text(text, document_id, document_name):
+    # Only the save happens inside the request, text and event extraction run in the background
+    saved_files = []
     try:
-        response = requests.post(
-            LLM_ENDPOINT,
-            headers={'Content-Type': 'application/json'},
-            json={
-                "prompt": document_extraction_prompt(text),
-                "n_predict": int(os.environ.get('LLM_CONTEXT_SIZE', '8192')),
-                "json_schema": document_extraction_grammar()
-            }
-        )
-
-        events = []
-        try:
-            response_text = response.text
-            log_message(f'LLM response: {response_text}')
-            
-            response_json = json.loads(response_text)
-            events = json.loads(response_json['content'])
-            events = [
-                {**event, "documentId": document_id, "document": document_name, "id": f"{int(time.time() * 1000)}_{i}"}
-                for i, event in enumerate(events)
-            ]
-        except Exception as e:
-            log_message(f'Error parsing LLM response: {e}')
-            log_message(f'Raw response: {response.text}')
-        
-        return events
-    except Exception as e:
-        log_message(f'Error extracting events: {e}')
-        return []
+        with metrics.timer("upload_save"):
+            for file in files:
+                if file and allowed_file(file.filename):
+                    saved_files.append(save_file(file))
+    except Exception:
+        for saved_file in saved_files:
+            blob_store.release(saved_file[4])
+        raise
+    if not saved_files:
+        return {"message": "No supported files uploaded"}, 400
+
+    job = submit_job(saved_files, case_id)
+    
+    return {
+        "message": "Documents uploaded and queued for processing",
+        "jobId": job["id"],
+        "job": jobs.summary(job["id"])
+    }, 202
 
 @documents_bp.route('/upload', methods=['POST'])
 def upload_documents():
-    # try:
+    """Uploads to the case in ?caseId=, the default case without one"""
+    case_id = requested_case(request.args)
+    # Includes receiving the files, the upload stream is consumed when request.files is first read
+    with metrics.timer("upload_request"):
         if 'documents' not in request.files:
             return jsonify({"message": "No files uploaded"}), 400
-        
-        files = request.files.getlist('documents')
-        if not files or len(files) == 0:
-            return jsonify({"message": "No files uploaded"}), 400
 
-        uploaded_documents = []
-        new_events = []
-
-        for file in files:
-            if file and allowed_file(file.filename):
-                document_id, filename, document_type, file_path = save_file(file)
-                
-                text = ""
-                if document_type == '.pdf':
-                    text = extract_text_from_pdf(file_path)
-                    # return jsonify({"message": "Text is extracted"}), 200
-                elif document_type == '.docx':
-                    text = extract_text_from_docx(file_path)
-                
-                if not text:
-                    return jsonify({"message": "There was no text in one of the files that was uploaded"}), 400
-                
-                document = {
-                    "id": document_id,
-                    "name": filename,
-                    "path": file_path,
-                    "type": document_type,
-                    "uploadDate": datetime.now().isoformat(),
-                    "text": text
-                }
-                
-                data.documents.append(document)
-                uploaded_documents.append(document)
-                
-                events = extract_events_from_text(text, document_id, filename)
-                new_events.extend(events)
-        
-        data.timeline_events.extend(new_events)
-        data.timeline_events.sort(key=lambda x: x.get('date', ''))
-        log_message(events, "Extracted events")
-        
-        return jsonify({
-            "message": "Documents uploaded and processed successfully",
-            "documents": uploaded_documents,
-            "events": new_events
-        }), 200
-    
-    # except Exception as e:
-    #     log_message(f"Error processing documents: {e}")
-    #     return jsonify({"message": "Error processing documents", "error": str(e)}), 500
+        body, status = queue_uploads(request.files.getlist('documents'), case_id)
+        return jsonify(body), status
+
+@documents_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = jobs.summary(job_id)
+    if not job:
+        return jsonify({"message": "Job not found"}), 404
+    return jsonify(job)
+
+def job_results(job_id):
+    """Documents and events of a job, None when there is no such job"""
+    job = jobs.get_job(job_id)
+    if not job:
+        return None
+
+    document_ids = [document["id"] for document in job["documents"]]
+    return {
+        "jobId": job_id,
+        "status": job["status"],
+        "documents": [
+            project(document, DOCUMENT_FIELDS) for document in data.get_documents_by_ids(document_ids, with_text=False)
+        ],
+        "events": jobs.events(job_id)
+    }
+
+@documents_bp.route('/jobs/<job_id>/events', methods=['GET'])
+def get_job_events(job_id):
+    results = job_results(job_id)
+    if not results:
+        return jsonify({"message": "Job not found"}), 404
+    return jsonify(results)
+
+@documents_bp.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify(extraction_cache.summary())
+
+@documents_bp.route('/extractions', methods=['GET'])
+def get_extractions():
+    """How many documents have events from the current extraction version, and how many wait for re-extraction"""
+    return jsonify(data.extraction_summary(extraction_cache.version))
 
 @documents_bp.route('/', methods=['GET'])
 def get_documents():
-    return jsonify(data.documents)
+    """Document metadata of the case in ?caseId=, ?fields=id,name limits it to the named fields"""
+    case_id = requested_case(request.args)
+    try:
+        fields = requested_fields(request.args)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    return jsonify([project(document, fields) for document in data.get_documents(case_id, with_text=False)])
 
 @documents_bp.route('/<document_id>', methods=['GET'])
 def get_document(document_id):
-    document = next((doc for doc in data.documents if doc['id'] == document_id), None)
+    case_id = requested_case(request.args)
+    try:
+        fields = requested_fields(request.args)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    document = data.get_document(document_id, with_text=False, case_id=case_id)
     if not document:
         return jsonify({"message": "Document not found"}), 404
-    return jsonify(document)
+    return jsonify(project(document, fields))
+
+@documents_bp.route('/<document_id>/text', methods=['GET'])
+def get_document_text(document_id):
+    """Extracted text as text/plain, byte ranges can be requested with a Range header"""
+    text = data.get_document_text(document_id, requested_case(request.args))
+    if text is None:
+        return jsonify({"message": "Document not found"}), 404
+    body = text.encode('utf-8')
+    response = Response(body, mimetype='text/plain')
+    response.add_etag(weak=True)
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(body))
+
+def remove_document(document_id, case_id):
+    """Delete a document of a case and release its file, returns whether it existed"""
+    document = data.get_document(document_id, with_text=False, case_id=case_id)
+    if not document or not data.delete_document(document_id):
+        return False
+    if document.get('hash'):
+        blob_store.release(document['hash'])
+    return True
+
+@documents_bp.route('/<document_id>', methods=['DELETE'])
+def delete_document(document_id):
+    if not remove_document(document_id, requested_case(request.args)):
+        return jsonify({"message": "Document not found"}), 404
+    return jsonify({"message": "Document deleted"})
+
+def encode_cursor(after):
+    return base64.urlsafe_b64encode(json.dumps(after).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    date_key, seq = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    return int(date_key), int(seq)
+
+def timeline_events(args):
+    """
+    Every event of the case in caseId when called without other parameters. With any of
+    from, to, limit or cursor it returns one page, {"events": [...], "nextCursor": ...},
+    where nextCursor is passed back as cursor for the following page and is null on the
+    last one. Raises ValueError for invalid parameters and UnknownCaseError.
+    """
+    case_id = requested_case(args)
+    if not any(key in args for key in ('from', 'to', 'limit', 'cursor')):
+        return data.get_timeline_events(case_id)
+
+    try:
+        limit = int(args.get('limit', TIMELINE_PAGE_SIZE))
+    except ValueError:
+        raise ValueError("limit must be a number")
+    limit = max(1, min(limit, TIMELINE_MAX_PAGE_SIZE))
+
+    after = None
+    if args.get('cursor'):
+        try:
+            after = decode_cursor(args['cursor'])
+        except Exception:
+            raise ValueError("Invalid cursor")
+
+    key_from, key_to = date_range(args.get('from'), args.get('to'))
+
+    events, next_after = data.query_events(case_id, key_from, key_to, limit, after)
+    return {
+        "events": events,
+        "nextCursor": encode_cursor(next_after) if next_after else None
+    }
+
+def timeline_periods(case_id, by):
+    """Event counts of a case per year, or per month. Year is null for dates without a year."""
+    if by not in ('year', 'month'):
+        raise ValueError("by must be year or month")
+
+    if by == 'year':
+        return [
+            {"year": period or None, "count": count}
+            for period, count in data.count_events_by_period(case_id, 10000)
+        ]
+    return [
+        {"year": period // 100 or None, "month": period % 100 or None, "count": count}
+        for period, count in data.count_events_by_period(case_id, 100)
+    ]
 
 @documents_bp.route('/timeline/events', methods=['GET'])
 def get_timeline_events():
-    return jsonify(data.timeline_events)
+    try:
+        return jsonify(timeline_events(request.args))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+@documents_bp.route('/timeline/periods', methods=['GET'])
+def get_timeline_periods():
+    try:
+        return jsonify(timeline_periods(requested_case(request.args), request.args.get('by', 'year')))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
@@ -0,0 +1,112 @@
+"""
+The documents blueprint for the ASGI app, same routes and JSON as routes/documents.py.
+Views that only touch SQLite stay synchronous, Quart runs them on its thread pool.
+"""
+from quart import Blueprint, Response, request, jsonify
+from quart.utils import run_sync
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from models.data import data
+from models.jobs import jobs
+from routes.cases import UnknownCaseError, requested_case
+from routes.documents import (
+    job_results, project, queue_uploads, remove_document, requested_fields, timeline_events, timeline_periods
+)
+from services.extraction_cache import extraction_cache
+from services.metrics import metrics
+
+documents_bp = Blueprint('documents', __name__)
+
+@documents_bp.errorhandler(RequestEntityTooLarge)
+async def file_too_large(e):
+    return jsonify({"message": e.description}), 413
+
+@documents_bp.errorhandler(UnknownCaseError)
+async def unknown_case(e):
+    return jsonify({"message": str(e)}), 404
+
+@documents_bp.route('/upload', methods=['POST'])
+async def upload_documents():
+    case_id = await run_sync(requested_case)(request.args)
+    with metrics.timer("upload_request"):
+        # Parsing streams the files into the blob store, see AsyncUploadRequest
+        files = await request.files
+        if 'documents' not in files:
+            return jsonify({"message": "No files uploaded"}), 400
+
+        body, status = await run_sync(queue_uploads)(files.getlist('documents'), case_id)
+        return jsonify(body), status
+
+@documents_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = jobs.summary(job_id)
+    if not job:
+        return jsonify({"message": "Job not found"}), 404
+    return jsonify(job)
+
+@documents_bp.route('/jobs/<job_id>/events', methods=['GET'])
+def get_job_events(job_id):
+    results = job_results(job_id)
+    if not results:
+        return jsonify({"message": "Job not found"}), 404
+    return jsonify(results)
+
+@documents_bp.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify(extraction_cache.summary())
+
+@documents_bp.route('/extractions', methods=['GET'])
+def get_extractions():
+    return jsonify(data.extraction_summary(extraction_cache.version))
+
+@documents_bp.route('/', methods=['GET'])
+def get_documents():
+    case_id = requested_case(request.args)
+    try:
+        fields = requested_fields(request.args)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    return jsonify([project(document, fields) for document in data.get_documents(case_id, with_text=False)])
+
+@documents_bp.route('/<document_id>', methods=['GET'])
+def get_document(document_id):
+    case_id = requested_case(request.args)
+    try:
+        fields = requested_fields(request.args)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    document = data.get_document(document_id, with_text=False, case_id=case_id)
+    if not document:
+        return jsonify({"message": "Document not found"}), 404
+    return jsonify(project(document, fields))
+
+@documents_bp.route('/<document_id>/text', methods=['GET'])
+async def get_document_text(document_id):
+    case_id = await run_sync(requested_case)(request.args)
+    text = await run_sync(data.get_document_text)(document_id, case_id)
+    if text is None:
+        return jsonify({"message": "Document not found"}), 404
+    body = text.encode('utf-8')
+    response = Response(body, mimetype='text/plain')
+    await response.add_etag(weak=True)
+    return await response.make_conditional(request, accept_ranges=True, complete_length=len(body))
+
+@documents_bp.route('/<document_id>', methods=['DELETE'])
+def delete_document(document_id):
+    if not remove_document(document_id, requested_case(request.args)):
+        return jsonify({"message": "Document not found"}), 404
+    return jsonify({"message": "Document deleted"})
+
+@documents_bp.route('/timeline/events', methods=['GET'])
+def get_timeline_events():
+    try:
+        return jsonify(timeline_events(request.args))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+@documents_bp.route('/timeline/periods', methods=['GET'])
+def get_timeline_periods():
+    try:
+        return jsonify(timeline_periods(requested_case(request.args), request.args.get('by', 'year')))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
@@ -0,0 +1,77 @@
+import os
+import gzip
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    # Optional, responses are gzipped without it
+    brotli = None
+
+# Bodies smaller than this go out as they are, compressing them saves nothing
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+COMPRESS_MIMETYPES = {'application/json', 'text/plain'}
+
+def accepted_encoding(accepted):
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+def buffered(response):
+    """Whether the whole body is in memory, streams and files are passed through untouched"""
+    return not response.is_streamed and not response.direct_passthrough
+
+def compressible(response, in_memory):
+    return (response.status_code == 200 and in_memory
+            and response.mimetype in COMPRESS_MIMETYPES and 'Content-Encoding' not in response.headers)
+
+def encode_body(body, accepted):
+    """(compressed body, encoding) for the encodings a client accepts, None when it goes out as it is"""
+    encoding = accepted_encoding(accepted)
+    if len(body) < COMPRESS_MIN_BYTES or encoding is None:
+        return None
+    return brotli.compress(body, quality=5) if encoding == 'br' else gzip.compress(body, compresslevel=6), encoding
+
+def compress(response):
+    if not compressible(response, buffered(response)):
+        return response
+    response.vary.add('Accept-Encoding')
+
+    encoded = encode_body(response.get_data(), request.accept_encodings)
+    if encoded:
+        response.set_data(encoded[0])
+        response.headers['Content-Encoding'] = encoded[1]
+    return response
+
+def finalize_response(response):
+    """
+    ETag and If-None-Match handling for GET responses, then compression. The ETag is weak,
+    so it still matches when the client sends it back for a compressed copy of the body.
+    """
+    if request.method == 'GET' and response.status_code == 200 and buffered(response):
+        if 'ETag' not in response.headers:
+            response.add_etag(weak=True)
+        response.make_conditional(request)
+    return compress(response)
+
+async def finalize_async_response(response):
+    """finalize_response for the ASGI app, where Quart's response methods are coroutines"""
+    from quart import request as async_request
+    from quart.wrappers.response import DataBody
+
+    in_memory = isinstance(response.response, DataBody)
+    if async_request.method == 'GET' and response.status_code == 200 and in_memory:
+        if 'ETag' not in response.headers:
+            await response.add_etag(weak=True)
+        response = await response.make_conditional(async_request)
+    if not compressible(response, isinstance(response.response, DataBody)):
+        return response
+    response.vary.add('Accept-Encoding')
+
+    encoded = encode_body(await response.get_data(), async_request.accept_encodings)
+    if encoded:
+        response.set_data(encoded[0])
+        response.headers['Content-Encoding'] = encoded[1]
+    return response
@@ -0,0 +1,16 @@
+"""
+Upload handling for the Flask app, shared by app.py and the ingestion benchmark.
+"""
+from flask import Request
+
+from services.blob_store import UPLOAD_MAX_REQUEST_BYTES, blob_store
+
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Uploaded files go straight to disk, hashed and size checked while they are received
+        return blob_store.upload_stream()
+
+def init_uploads(app):
+    app.request_class = UploadRequest
+    # Each file is limited while it is received, this bounds a request carrying many of them
+    app.config['MAX_CONTENT_LENGTH'] = UPLOAD_MAX_REQUEST_BYTES
@@ -0,0 +1,127 @@
+import os
+import random
+import asyncio
+from contextlib import asynccontextmanager
+import httpx
+
+from services.http_client import CircuitBreaker, ServerError
+from services.metrics import metrics
+from utils import log_warning
+
+# What says the service is down, see SERVICE_ERRORS in services.http_client
+SERVICE_ERRORS = (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)
+
+class AsyncServiceClient:
+    """
+    asyncio counterpart of ServiceClient for the ASGI app: the same timeouts, retries and
+    circuit breaker, with a waiting request costing a coroutine instead of a thread.
+    """
+    def __init__(self, name, connect_timeout, read_timeout, max_concurrency, max_retries,
+                 backoff, retry_on_timeout, failure_threshold, reset_timeout):
+        self.name = name
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.retry_on_timeout = retry_on_timeout
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+
+        # Keep-alive connections, enough of them for every concurrent caller
+        self.client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+        )
+
+    @asynccontextmanager
+    async def slot(self):
+        async with self.slots:
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+
+    def should_retry(self, error):
+        if isinstance(error, httpx.TimeoutException):
+            return self.retry_on_timeout
+        if isinstance(error, SERVICE_ERRORS):
+            return True
+        return isinstance(error, ServerError)
+
+    async def post(self, url, **kwargs):
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                async with self.slot():
+                    response = await self.client.post(url, **kwargs)
+                if response.status_code >= 500:
+                    raise ServerError(f"{self.name} returned status code {response.status_code}", response)
+                self.breaker.record_success()
+                return response
+            except (*SERVICE_ERRORS, ServerError) as e:
+                self.breaker.record_failure()
+                if attempt >= self.max_retries or not self.should_retry(e):
+                    if isinstance(e, ServerError):
+                        return e.response
+                    raise
+                # Full jitter, so callers failing together do not retry together
+                delay = random.uniform(0, self.backoff * (2 ** attempt))
+                attempt += 1
+                log_warning("%s request failed (%s), retry %s/%s in %.2fs", self.name, e, attempt, self.max_retries, delay)
+                await asyncio.sleep(delay)
+            except BaseException:
+                # Cancelled, or an error on our side like an invalid URL: the service is neither healthy nor failing
+                self.breaker.release_trial()
+                raise
+
+    @asynccontextmanager
+    async def stream(self, url, **kwargs):
+        """Streaming POST, not retried, the concurrency slot is held until the caller is done reading"""
+        self.breaker.before_call()
+        recorded = False
+        try:
+            async with self.slot():
+                try:
+                    request = self.client.build_request('POST', url, **kwargs)
+                    response = await self.client.send(request, stream=True)
+                except SERVICE_ERRORS:
+                    recorded = True
+                    self.breaker.record_failure()
+                    raise
+                recorded = True
+                if response.status_code >= 500:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                try:
+                    yield response
+                finally:
+                    # Closing the connection is what tells the llama server to stop generating
+                    await response.aclose()
+        finally:
+            # Cancelled while waiting for a slot or the response headers
+            if not recorded:
+                self.breaker.release_trial()
+
+    async def close(self):
+        await self.client.aclose()
+
+def async_service_client(name, prefix, read_timeout, max_concurrency, retry_on_timeout):
+    return AsyncServiceClient(
+        name,
+        connect_timeout=float(os.environ.get(f'{prefix}_CONNECT_TIMEOUT', '5')),
+        read_timeout=float(os.environ.get(f'{prefix}_READ_TIMEOUT', str(read_timeout))),
+        max_concurrency=int(os.environ.get(f'{prefix}_MAX_CONCURRENCY', str(max_concurrency))),
+        max_retries=int(os.environ.get(f'{prefix}_MAX_RETRIES', '2')),
+        backoff=float(os.environ.get(f'{prefix}_RETRY_BACKOFF', '0.5')),
+        retry_on_timeout=retry_on_timeout,
+        failure_threshold=int(os.environ.get(f'{prefix}_CIRCUIT_FAILURES', '3')),
+        reset_timeout=float(os.environ.get(f'{prefix}_CIRCUIT_RESET_SECONDS', '30'))
+    )
+
+# Chat streams wait on the llama server for their whole answer, one process can hold many of them
+async_llm_client = async_service_client('LLM service', 'LLM', read_timeout=600, max_concurrency=4, retry_on_timeout=False)
+metrics.watch_client(async_llm_client)
@@ -0,0 +1,123 @@
+import os
+import glob
+import hashlib
+import tempfile
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from models.data import data
+from utils import get_file_path, log_debug, log_warning
+
+UPLOAD_FOLDER = os.environ.get('UPLOAD_DIR', get_file_path('uploads'))
+UPLOAD_MAX_FILE_BYTES = int(os.environ.get('UPLOAD_MAX_FILE_BYTES', str(10 * 1024 * 1024)))  # 10MB
+UPLOAD_MAX_FILES = int(os.environ.get('UPLOAD_MAX_FILES', '20'))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# Whole request body, the files at their largest plus room for the form around them
+UPLOAD_MAX_REQUEST_BYTES = UPLOAD_MAX_FILES * UPLOAD_MAX_FILE_BYTES + UPLOAD_CHUNK_BYTES
+
+class HashingUpload:
+    """
+    File-like target for an uploaded file. Werkzeug's form parser writes the upload
+    into it chunk by chunk, while the SHA-256 and size are computed on the way and
+    the size limit is enforced before the rest of the file is read off the socket.
+    """
+    def __init__(self, directory, max_bytes):
+        self.max_bytes = max_bytes
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.stored = False
+        fd, self.path = tempfile.mkstemp(dir=directory, suffix='.part')
+        self.file = os.fdopen(fd, 'w+b')
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            # The parser drops this stream without closing it, nothing else would remove the file
+            self.close()
+            raise RequestEntityTooLarge(f"Uploaded files may not be larger than {self.max_bytes} bytes")
+        self.digest.update(chunk)
+        return self.file.write(chunk)
+
+    def read(self, *args):
+        return self.file.read(*args)
+
+    def seek(self, *args):
+        return self.file.seek(*args)
+
+    def tell(self):
+        return self.file.tell()
+
+    def flush(self):
+        return self.file.flush()
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+        # An upload that never made it into the store leaves nothing behind
+        if not self.stored and os.path.exists(self.path):
+            os.remove(self.path)
+
+class BlobStore:
+    """
+    Uploaded files stored once per content hash under uploads/blobs, shared by every
+    document with the same content. The blobs table counts the documents using a
+    blob, the file is removed when the last one releases it.
+    """
+    def __init__(self, root, max_file_bytes):
+        self.root = root
+        self.max_file_bytes = max_file_bytes
+        self.temp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.temp_dir, exist_ok=True)
+
+    def blob_path(self, content_hash, extension):
+        return os.path.join(self.root, 'blobs', content_hash[:2], f"{content_hash}{extension}")
+
+    def upload_stream(self):
+        return HashingUpload(self.temp_dir, self.max_file_bytes)
+
+    def remove_partial_uploads(self):
+        """Delete the temp files of uploads a stopped server never finished, only safe before serving"""
+        paths = glob.glob(os.path.join(self.temp_dir, '*.part'))
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        if paths:
+            log_warning("Removed %s partial uploads left by the last shutdown", len(paths))
+
+    def store(self, stream, extension):
+        """(content hash, path) of an uploaded file stream, taking a reference on its blob"""
+        if not isinstance(stream, HashingUpload):
+            # Not parsed through UploadRequest, copy it over in chunks
+            upload = self.upload_stream()
+            try:
+                for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_BYTES), b''):
+                    upload.write(chunk)
+            except Exception:
+                upload.close()
+                raise
+            stream = upload
+
+        content_hash = stream.hexdigest()
+        stream.file.close()
+        try:
+            # Take the reference before the file lands, so a concurrent release cannot delete it
+            path = data.acquire_blob(content_hash, self.blob_path(content_hash, extension), stream.size)
+            if os.path.exists(path):
+                log_debug("Blob %s already stored, skipping write", content_hash)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(stream.path, path)
+                stream.stored = True
+        finally:
+            stream.close()
+        return content_hash, path
+
+    def release(self, content_hash):
+        data.release_blob(content_hash, os.remove)
+
+# Create a singleton instance
+blob_store = BlobStore(UPLOAD_FOLDER, UPLOAD_MAX_FILE_BYTES)
@@ -0,0 +1,84 @@
+import os
+import re
+
+# Rough size of a token for the Mistral/Llama tokenizers on English prose
+CHARS_PER_TOKEN = 4
+
+LLM_CHUNK_TOKENS = int(os.environ.get('LLM_CHUNK_TOKENS', '1500'))
+LLM_CHUNK_OVERLAP_TOKENS = int(os.environ.get('LLM_CHUNK_OVERLAP_TOKENS', '150'))
+
+PAGE_BREAK = '\f'
+PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def split_blocks(text, max_chars):
+    """Split text into pages and paragraphs, breaking up any block larger than max_chars"""
+    blocks = []
+    for page in text.split(PAGE_BREAK):
+        for paragraph in PARAGRAPH_BREAK.split(page):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            if len(paragraph) <= max_chars:
+                blocks.append(paragraph)
+                continue
+
+            # Oversized paragraph, fall back to line and then character boundaries
+            current = ""
+            for line in paragraph.split('\n'):
+                while len(line) > max_chars:
+                    if current:
+                        blocks.append(current)
+                        current = ""
+                    blocks.append(line[:max_chars])
+                    line = line[max_chars:]
+                if current and len(current) + len(line) + 1 > max_chars:
+                    blocks.append(current)
+                    current = ""
+                current = f"{current}\n{line}" if current else line
+            if current:
+                blocks.append(current)
+    return blocks
+
+def chunk_text(text, max_tokens=LLM_CHUNK_TOKENS, overlap_tokens=LLM_CHUNK_OVERLAP_TOKENS):
+    """
+    Split text into chunks of at most max_tokens on page and paragraph boundaries.
+    Each chunk starts with up to overlap_tokens worth of the trailing blocks of the
+    previous chunk, so events spanning a boundary are seen whole at least once.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    overlap_chars = min(overlap_tokens * CHARS_PER_TOKEN, max_chars // 2)
+
+    chunks = []
+    current = []
+    current_size = 0
+    for block in split_blocks(text, max_chars):
+        if current and current_size + len(block) + 2 > max_chars:
+            chunks.append("\n\n".join(current))
+
+            # Carry the tail of the finished chunk over as overlap
+            overlap = []
+            overlap_size = 0
+            for previous in reversed(current):
+                if overlap_size + len(previous) + 2 > overlap_chars:
+                    break
+                overlap.insert(0, previous)
+                overlap_size += len(previous) + 2
+            if not overlap and overlap_chars > 0:
+                # Last block alone is larger than the overlap, carry its tail instead
+                overlap = [current[-1][-overlap_chars:]]
+                overlap_size = len(overlap[0]) + 2
+            if overlap_size + len(block) + 2 > max_chars:
+                overlap = []
+                overlap_size = 0
+            current = overlap
+            current_size = overlap_size
+
+        current.append(block)
+        current_size += len(block) + 2
+
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
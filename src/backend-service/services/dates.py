@@ -0,0 +1,101 @@
+import re
+from datetime import date
+
+# How much of an event date is known
+PRECISION_DAY = 'day'
+PRECISION_MONTH = 'month'
+PRECISION_YEAR = 'year'
+# Month and day without a year, as in "05-03"
+PRECISION_NO_YEAR = 'no-year'
+
+# Sort keys are YYYYMMDD integers with the unknown parts as zero, so 2019 sorts before
+# 2019-01 before 2019-01-01. Without a year there is no telling where "05-03" belongs among
+# dated events, so those sort after all of them, by month and day, at NO_YEAR_SORT_KEY + MMDD.
+# Dates that cannot be read sort after everything.
+NO_YEAR_SORT_KEY = 100000000
+UNDATED_SORT_KEY = 200000000
+
+FULL_DATE = re.compile(r'(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})')
+YEAR_MONTH = re.compile(r'(\d{4})[-/.](\d{1,2})')
+YEAR = re.compile(r'(\d{4})')
+MONTH_DAY = re.compile(r'(\d{1,2})[-/.](\d{1,2})')
+
+def sort_key(year, month=0, day=0):
+    return year * 10000 + month * 100 + day
+
+def valid(year, month, day):
+    try:
+        # 2000 is a leap year, so 02-29 without a year is accepted
+        date(year or 2000, month or 1, day or 1)
+        return True
+    except ValueError:
+        return False
+
+def normalize_date(value):
+    """
+    (sort key, precision) of a date as the LLM writes it: YYYY-MM-DD, YYYY-MM, YYYY or MM-DD,
+    optionally followed by a time. Unreadable dates give (UNDATED_SORT_KEY, None).
+    """
+    text = str(value or '').strip().split('T')[0].split(' ')[0]
+
+    match = FULL_DATE.fullmatch(text)
+    if match:
+        year, month, day = (int(part) for part in match.groups())
+        if valid(year, month, day):
+            return sort_key(year, month, day), PRECISION_DAY
+
+    match = YEAR_MONTH.fullmatch(text)
+    if match:
+        year, month = (int(part) for part in match.groups())
+        if valid(year, month, 0):
+            return sort_key(year, month), PRECISION_MONTH
+
+    match = YEAR.fullmatch(text)
+    if match:
+        return sort_key(int(match.group(1))), PRECISION_YEAR
+
+    match = MONTH_DAY.fullmatch(text)
+    if match:
+        month, day = (int(part) for part in match.groups())
+        if valid(0, month, day):
+            return NO_YEAR_SORT_KEY + sort_key(0, month, day), PRECISION_NO_YEAR
+
+    return UNDATED_SORT_KEY, None
+
+def date_bound(value, upper=False):
+    """
+    Sort key bounding a range query, from a date of any precision. A lower bound of 2019
+    starts at 20190000 and an upper bound of 2019 ends at 20199999, so both take in every
+    event dated in 2019 whatever its precision. Raises ValueError for unreadable dates.
+    """
+    key, precision = normalize_date(value)
+    if precision is None:
+        raise ValueError(f"Unrecognized date: {value}")
+    if not upper or precision in (PRECISION_DAY, PRECISION_NO_YEAR):
+        return key
+    if precision == PRECISION_MONTH:
+        return key + 99
+    return key + 9999
+
+def date_range(value_from=None, value_to=None):
+    """
+    (lowest, highest) sort key of the events between two date bounds, either may be left out.
+    A range of dated events stops where they end, dates without a year or that cannot be read
+    are in none. With a bound without a year, the range is over the dates without a year.
+    (None, None) without any bound.
+    """
+    if not value_from and not value_to:
+        return None, None
+    key_from = date_bound(value_from) if value_from else None
+    key_to = date_bound(value_to, upper=True) if value_to else None
+    no_year = any(key is not None and key >= NO_YEAR_SORT_KEY for key in (key_from, key_to))
+    if key_from is None:
+        key_from = NO_YEAR_SORT_KEY if no_year else 0
+    if key_to is None:
+        key_to = UNDATED_SORT_KEY - 1 if no_year else NO_YEAR_SORT_KEY - 1
+    return key_from, key_to
+
+def normalize_event_date(event):
+    """The event with dateKey and datePrecision set, its date string is kept as written"""
+    key, precision = normalize_date(event.get('date'))
+    return {**event, "dateKey": key, "datePrecision": precision}
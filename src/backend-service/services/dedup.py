@@ -0,0 +1,85 @@
+import os
+import re
+import random
+import hashlib
+from array import array
+
+# Similarity above which two events on the same date are the same event
+EVENT_DEDUP_THRESHOLD = float(os.environ.get('EVENT_DEDUP_THRESHOLD', '0.5'))
+# Titles name the event, descriptions and context are phrased differently per source
+TITLE_WEIGHT = 0.6
+# Least description and context similarity for a merge, a matching title alone is not enough
+EVENT_DEDUP_MIN_TEXT_SIMILARITY = float(os.environ.get('EVENT_DEDUP_MIN_TEXT_SIMILARITY', '0.2'))
+MINHASH_PERMUTATIONS = 64
+MERSENNE_PRIME = (1 << 61) - 1
+
+# Fixed seed, signatures are stored and must stay comparable across restarts
+_random = random.Random(20190101)
+PERMUTATIONS = [
+    (_random.randrange(1, MERSENNE_PRIME), _random.randrange(0, MERSENNE_PRIME))
+    for _ in range(MINHASH_PERMUTATIONS)
+]
+
+def normalize(text):
+    return re.sub(r'\W+', ' ', str(text or '')).strip().lower()
+
+def char_shingles(text, size=3):
+    text = normalize(text)
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+def word_shingles(text, size=2):
+    words = normalize(text).split()
+    if len(words) <= size:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def minhash(shingles):
+    """MINHASH_PERMUTATIONS minimum hashes of a shingle set, equal positions estimate the Jaccard similarity"""
+    if not shingles:
+        return [MERSENNE_PRIME] * MINHASH_PERMUTATIONS
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'big') for s in shingles]
+    return [min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in PERMUTATIONS]
+
+def event_signature(event):
+    """MinHash of the title's character shingles followed by that of the description and context, as bytes"""
+    title = minhash(char_shingles(event.get('title')))
+    text = minhash(word_shingles(f"{event.get('description', '')} {event.get('context', '')}"))
+    return array('Q', title + text).tobytes()
+
+def agreement(a, b):
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+def similarities(signature, other):
+    """(title similarity, description and context similarity) of two signatures"""
+    a = array('Q', signature)
+    b = array('Q', other)
+    n = MINHASH_PERMUTATIONS
+    return agreement(a[:n], b[:n]), agreement(a[n:], b[n:])
+
+class EventDeduplicator:
+    """
+    Finds the stored event a new one duplicates. Data.add_document only offers the
+    events with the same date key, so each event is compared against a handful of
+    candidates and the total cost stays close to linear in the number of events.
+    """
+    def __init__(self, threshold, min_text_similarity):
+        self.threshold = threshold
+        self.min_text_similarity = min_text_similarity
+
+    def signature(self, event):
+        return event_signature(event)
+
+    def best_match(self, signature, candidates):
+        """seq of the most similar of the (seq, signature) candidates above the threshold, or None"""
+        best_seq, best_score = None, self.threshold
+        for seq, other in candidates:
+            title, text = similarities(signature, other)
+            score = TITLE_WEIGHT * title + (1 - TITLE_WEIGHT) * text
+            if score >= best_score and text >= self.min_text_similarity:
+                best_seq, best_score = seq, score
+        return best_seq
+
+# Create a singleton instance
+event_deduplicator = EventDeduplicator(EVENT_DEDUP_THRESHOLD, EVENT_DEDUP_MIN_TEXT_SIMILARITY)
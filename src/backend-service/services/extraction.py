@@ -0,0 +1,241 @@
+import os
+import re
+import json
+from concurrent.futures import ThreadPoolExecutor
+import pymupdf
+import docx2txt
+
+from services.chunking import PAGE_BREAK, LLM_CHUNK_TOKENS, chunk_text
+from services.dates import normalize_event_date
+from services.http_client import NOUGAT_ENDPOINTS, llm_client, nougat_clients
+from services.metrics import metrics
+from services.pdf_triage import page_ranges, score_page
+from services.tokens import LLM_CONTEXT_SIZE, PROMPT_MARGIN_TOKENS, plan_request, token_counter
+from utils import log_error, log_message, log_payload, log_warning, sortable_id, document_extraction_grammar, document_extraction_prompt
+
+# Scanned pages sent to Nougat in one request, smaller ranges spread better over instances
+NOUGAT_PAGES_PER_REQUEST = int(os.environ.get('NOUGAT_PAGES_PER_REQUEST', '8'))
+LLM_ENDPOINT = os.environ.get('LLM_ENDPOINT_PATH', "http://localhost:8080/answer")
+# Number of chunk requests in flight towards the llama server, across all documents
+LLM_CHUNK_CONCURRENCY = int(os.environ.get('LLM_CHUNK_CONCURRENCY', '4'))
+LLM_EXTRACTION_PREDICT = int(os.environ.get('LLM_EXTRACTION_PREDICT', '2048'))
+# Smallest answer budget a chunk is allowed to leave, larger chunks are split again
+LLM_EXTRACTION_MIN_PREDICT = int(os.environ.get('LLM_EXTRACTION_MIN_PREDICT', '512'))
+
+chunk_executor = ThreadPoolExecutor(max_workers=LLM_CHUNK_CONCURRENCY, thread_name_prefix='llm-chunk')
+# Enough threads to keep every slot of every Nougat instance busy
+nougat_executor = ThreadPoolExecutor(
+    max_workers=sum(client.max_concurrency for client in nougat_clients),
+    thread_name_prefix='nougat-range'
+)
+
+def nougat_request(endpoint, client, pdf_file, start_page=None, end_page=None):
+    # The page range is read from the query string by the Nougat API, 1-based with stop included
+    params = {}
+    if start_page is not None:
+        params['start'] = start_page
+    if end_page is not None:
+        params['stop'] = end_page
+        
+    log_message("Sending PDF to Nougat service at %s with params: %s", endpoint, params)
+    with metrics.timer("nougat_request"):
+        response = client.post(endpoint, files={'file': pdf_file}, params=params)
+    
+    if response.status_code != 200:
+        log_error("Error from nougat service, status code %s", response.status_code)
+        log_payload("nougat.error_response", response.text)
+        raise Exception(f"Nougat service returned status code {response.status_code}")
+    
+    try:
+        result = response.json()
+        log_payload("nougat.result", result)
+        if isinstance(result, dict) and 'text' in result:
+            text = result['text']
+        else:
+            text = str(result)
+    except ValueError:
+        text = response.text
+    
+    log_message("Extracted text length: %s", len(text))
+    return text
+
+def nougat_pdf_text_extraction(file_path, start_page=None, end_page=None, pdf_file=None):
+    """
+    Text of a page range from the least busy Nougat instance. A failed range is
+    tried once on every other instance before giving up.
+    """
+    if pdf_file is None:
+        # Read up front so retries and other instances can send the file again
+        with open(file_path, 'rb') as f:
+            pdf_file = (os.path.basename(file_path), f.read(), 'application/pdf')
+
+    instances = list(zip(NOUGAT_ENDPOINTS, nougat_clients))
+    error = None
+    while instances:
+        endpoint, client = min(instances, key=lambda instance: (instance[1].breaker.state == "open", instance[1].in_flight))
+        instances.remove((endpoint, client))
+        try:
+            return nougat_request(endpoint, client, pdf_file, start_page, end_page)
+        except Exception as e:
+            log_warning("Nougat service at %s failed on pages %s-%s: %s", endpoint, start_page, end_page, e)
+            error = e
+            if instances:
+                metrics.increment("chronolaw_fallbacks_total", kind="nougat_instance_failover")
+    raise error
+
+def split_page_ranges(ranges, pages_per_request):
+    """Cut (start, stop) ranges into pieces of at most pages_per_request pages"""
+    pieces = []
+    for start, stop in ranges:
+        for piece_start in range(start, stop + 1, pages_per_request):
+            pieces.append((piece_start, min(piece_start + pages_per_request - 1, stop)))
+    return pieces
+
+def extract_text_from_pdf(file_path):
+    """
+    Text of a PDF, page by page. Pages with a usable text layer are read with pymupdf,
+    only the pages that look scanned are sent to Nougat. They go out as ranges of at
+    most NOUGAT_PAGES_PER_REQUEST pages, in parallel across the Nougat instances. A
+    range Nougat fails on keeps whatever pymupdf found.
+    """
+    try:
+        with metrics.timer("pdf_text_layer"), pymupdf.open(file_path) as reader:
+            pages = [score_page(page) for page in reader]
+    except Exception as e:
+        # pymupdf cannot read it, Nougat may still be able to
+        log_warning("Error reading PDF text layer, sending the whole file to Nougat: %s", e)
+        metrics.increment("chronolaw_fallbacks_total", kind="pdf_whole_file_nougat")
+        return nougat_pdf_text_extraction(file_path)
+
+    page_texts = [page["text"] for page in pages]
+    ocr_pages = [number for number, page in enumerate(pages, start=1) if page["needsOcr"]]
+    log_message("%s of %s pages need OCR: %s", len(ocr_pages), len(pages), ocr_pages)
+    if not ocr_pages:
+        return PAGE_BREAK.join(text + "\n" for text in page_texts)
+
+    with open(file_path, 'rb') as f:
+        pdf_file = (os.path.basename(file_path), f.read(), 'application/pdf')
+
+    ranges = split_page_ranges(page_ranges(ocr_pages), NOUGAT_PAGES_PER_REQUEST)
+    futures = [
+        nougat_executor.submit(nougat_pdf_text_extraction, file_path, start, stop, pdf_file)
+        for start, stop in ranges
+    ]
+    for (start, stop), future in zip(ranges, futures):
+        try:
+            text = future.result()
+        except Exception as e:
+            log_warning("Error extracting pages %s-%s with Nougat, keeping the text layer: %s", start, stop, e)
+            metrics.increment("chronolaw_fallbacks_total", kind="nougat_range_text_layer")
+            continue
+        # Nougat returns a range as one text, it takes the place of the range's first page
+        page_texts[start - 1] = text
+        for number in range(start + 1, stop + 1):
+            page_texts[number - 1] = ""
+
+    return PAGE_BREAK.join(text + "\n" for text in page_texts)
+
+def extract_text_from_docx(file_path):
+    try:
+        with metrics.timer("docx_extraction"):
+            text = docx2txt.process(file_path)
+        return text
+    except Exception as e:
+        log_error("Error extracting text from DOCX: %s", e)
+        raise e
+
+def extract_text(file_path, document_type):
+    if document_type == '.pdf':
+        return extract_text_from_pdf(file_path)
+    elif document_type == '.docx':
+        return extract_text_from_docx(file_path)
+    return ""
+
+def extraction_prompts(text, max_tokens=LLM_CHUNK_TOKENS):
+    """
+    (prompt, prompt tokens) per chunk of text, measured with the model's tokenizer.
+    Chunks whose prompt would leave less than LLM_EXTRACTION_MIN_PREDICT tokens of
+    context are split again with a proportionally smaller budget.
+    """
+    limit = LLM_CONTEXT_SIZE - LLM_EXTRACTION_MIN_PREDICT - PROMPT_MARGIN_TOKENS
+    chunks = chunk_text(text, max_tokens)
+    prompts = [document_extraction_prompt(chunk) for chunk in chunks]
+    counts = token_counter.count_many(prompts)
+
+    planned = []
+    for chunk, prompt, count in zip(chunks, prompts, counts):
+        smaller = int(max_tokens * limit / count * 0.9)
+        if count <= limit or smaller < 1 or smaller >= max_tokens:
+            planned.append((prompt, count))
+        else:
+            planned.extend(extraction_prompts(chunk, smaller))
+    return planned
+
+def extract_events_from_chunk(planned_prompt):
+    """Events the LLM found in one chunk, None when the request or the parsing of its answer failed"""
+    prompt, prompt_tokens = planned_prompt
+    try:
+        with metrics.timer("llm_extraction_request"):
+            response = llm_client.post(
+                LLM_ENDPOINT,
+                headers={'Content-Type': 'application/json'},
+                json={
+                    "prompt": prompt,
+                    "n_predict": plan_request(prompt_tokens, LLM_EXTRACTION_PREDICT, label="event extraction"),
+                    "json_schema": document_extraction_grammar()
+                }
+            )
+
+        try:
+            response_text = response.text
+            log_payload("extraction.llm_response", response_text)
+            
+            response_json = json.loads(response_text)
+            metrics.observe_llm_timings("extraction", response_json)
+            return json.loads(response_json['content'])
+        except Exception as e:
+            log_error("Error parsing LLM response: %s", e)
+            metrics.increment("chronolaw_parse_failures_total", kind="extraction")
+            log_payload("extraction.raw_response", response.text)
+            return None
+    except Exception as e:
+        log_error("Error extracting events: %s", e)
+        return None
+
+def event_key(event):
+    """Identity of an event for merging the results of overlapping chunks"""
+    title = re.sub(r'\W+', ' ', str(event.get('title', ''))).strip().lower()
+    return (str(event.get('date', '')).strip(), title)
+
+def merge_chunk_events(chunk_events):
+    """Events of all chunks without the overlap duplicates, failed chunks (None) are skipped"""
+    merged = {}
+    for events in chunk_events:
+        for event in events or []:
+            if not isinstance(event, dict):
+                continue
+            key = event_key(event)
+            # Overlap means the same event can come back from two chunks, keep the more detailed one
+            if key not in merged or len(str(event.get('description', ''))) > len(str(merged[key].get('description', ''))):
+                merged[key] = event
+    return list(merged.values())
+
+def extract_chunk_events(text):
+    """Events per chunk of the text, None for the chunks whose request failed"""
+    # Map: every chunk is an independent /answer request, merge_chunk_events is the reduce
+    prompts = extraction_prompts(text)
+    log_message("Extracting events from %s chunk(s)", len(prompts))
+    return list(chunk_executor.map(extract_events_from_chunk, prompts))
+
+def extract_event_payloads(text):
+    """Events found in the text, before they are tied to a document"""
+    return merge_chunk_events(extract_chunk_events(text))
+
+def bind_events(events, document_id, document_name):
+    return [
+        {**normalize_event_date(event), "documentId": document_id, "document": document_name, "id": sortable_id()}
+        for event in events
+    ]
+
+def extract_events_from_text(text, document_id, document_name):
+    return bind_events(extract_event_payloads(text), document_id, document_name)
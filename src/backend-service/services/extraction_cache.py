@@ -0,0 +1,149 @@
+import os
+import json
+import hashlib
+import threading
+
+from services.chunking import LLM_CHUNK_TOKENS, LLM_CHUNK_OVERLAP_TOKENS
+from services.metrics import metrics
+from utils import get_file_path, log_debug, document_extraction_grammar, document_extraction_prompt
+
+EXTRACTION_CACHE_DIR = os.environ.get('EXTRACTION_CACHE_DIR', get_file_path('cache'))
+EXTRACTION_CACHE_MAX_BYTES = int(os.environ.get('EXTRACTION_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))  # 512MB
+# Eviction goes down to this share of the limit, so a full cache is not scanned on every write
+EXTRACTION_CACHE_EVICT_TO = 0.9
+
+def extraction_version():
+    """Hash of everything besides the document that decides which events the LLM returns"""
+    digest = hashlib.sha256()
+    digest.update(document_extraction_prompt("{text}").encode('utf-8'))
+    digest.update(json.dumps(document_extraction_grammar(), sort_keys=True).encode('utf-8'))
+    digest.update(os.environ.get('LLM_MODEL_PATH', '').encode('utf-8'))
+    digest.update(f"{LLM_CHUNK_TOKENS}:{LLM_CHUNK_OVERLAP_TOKENS}".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+class ExtractionCache:
+    """
+    On-disk cache of extracted text, keyed by file content hash, and of extracted
+    events, keyed by content hash plus extraction version. Entries are evicted
+    least recently used first once the cache grows past max_bytes.
+    The size is a running total of what this process wrote since it last scanned the
+    directory, at startup and whenever the total goes over max_bytes. Under gunicorn
+    each worker only adds its own writes, so the cache can briefly grow past the limit
+    until one of them scans.
+    """
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.version = extraction_version()
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.join(directory, 'text'), exist_ok=True)
+        os.makedirs(os.path.join(directory, 'events'), exist_ok=True)
+        self.total_bytes = sum(size for _, size, _ in self.entries())
+
+    def text_path(self, content_hash):
+        return os.path.join(self.directory, 'text', f"{content_hash}.txt")
+
+    def events_path(self, content_hash):
+        return os.path.join(self.directory, 'events', f"{content_hash}-{self.version}.json")
+
+    def read(self, path, kind):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = f.read()
+            # Recency for LRU eviction is tracked through the modification time
+            os.utime(path)
+        except FileNotFoundError:
+            value = None
+        # Through metrics, so the counts cover every gunicorn worker
+        metrics.increment("chronolaw_extraction_cache_total", kind=kind, result="hit" if value is not None else "miss")
+        return value
+
+    def write(self, path, value):
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(value)
+        size = os.path.getsize(temp_path)
+        try:
+            replaced = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(temp_path, path)
+        with self.lock:
+            self.total_bytes += size - replaced
+            over = self.total_bytes > self.max_bytes
+        if over:
+            self.evict()
+
+    def get_text(self, content_hash):
+        return self.read(self.text_path(content_hash), "text")
+
+    def put_text(self, content_hash, text):
+        self.write(self.text_path(content_hash), text)
+
+    def get_events(self, content_hash):
+        value = self.read(self.events_path(content_hash), "events")
+        return json.loads(value) if value is not None else None
+
+    def put_events(self, content_hash, events):
+        self.write(self.events_path(content_hash), json.dumps(events))
+
+    def entries(self):
+        for kind in ('text', 'events'):
+            folder = os.path.join(self.directory, kind)
+            for name in os.listdir(folder):
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(folder, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def evict(self):
+        """Rescan the directory and remove the least recently used entries when it is over max_bytes"""
+        with self.lock:
+            entries = sorted(self.entries(), key=lambda entry: entry[2])
+            total = sum(size for _, size, _ in entries)
+            if total > self.max_bytes:
+                for path, size, _ in entries:
+                    if total <= self.max_bytes * EXTRACTION_CACHE_EVICT_TO:
+                        break
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    total -= size
+                    metrics.increment("chronolaw_extraction_cache_evictions_total")
+                    log_debug("Evicted %s from the extraction cache", os.path.basename(path))
+            self.total_bytes = total
+
+    def clear(self):
+        with self.lock:
+            for path, _, _ in list(self.entries()):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self.total_bytes = 0
+
+    def summary(self):
+        lookups = metrics.counter_totals("chronolaw_extraction_cache_total")
+        evictions = metrics.counter_totals("chronolaw_extraction_cache_evictions_total")
+        with self.lock:
+            entries = list(self.entries())
+            return {
+                "textHits": lookups.get((("kind", "text"), ("result", "hit")), 0),
+                "textMisses": lookups.get((("kind", "text"), ("result", "miss")), 0),
+                "eventHits": lookups.get((("kind", "events"), ("result", "hit")), 0),
+                "eventMisses": lookups.get((("kind", "events"), ("result", "miss")), 0),
+                "evictions": evictions.get((), 0),
+                "version": self.version,
+                "entries": len(entries),
+                "bytes": sum(size for _, size, _ in entries),
+                "maxBytes": self.max_bytes
+            }
+
+# Create a singleton instance
+extraction_cache = ExtractionCache(EXTRACTION_CACHE_DIR, EXTRACTION_CACHE_MAX_BYTES)
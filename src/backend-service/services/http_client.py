@@ -0,0 +1,203 @@
+import os
+import time
+import random
+import threading
+from contextlib import contextmanager
+import requests
+from requests.adapters import HTTPAdapter
+
+from services.metrics import metrics
+from utils import log_message, log_warning
+
+# What says the service is down. Other request errors, like an invalid URL or header from a bad
+# setting, are ours and leave the circuit alone.
+SERVICE_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+class CircuitOpenError(Exception):
+    """Raised without calling the backend while its circuit breaker is open"""
+
+class ServerError(Exception):
+    """A 5xx response, retried like a connection error"""
+    def __init__(self, message, response):
+        super().__init__(message)
+        self.response = response
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for
+    `reset_timeout` seconds. After that a single trial call is let through, its
+    outcome closes the circuit again or re-opens it.
+    """
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_timeout or self.trial_in_flight:
+                raise CircuitOpenError(f"{self.name} is unavailable, circuit is open")
+            self.trial_in_flight = True
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                log_message("%s recovered, closing circuit", self.name)
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    log_warning("%s failed %s times in a row, opening circuit", self.name, self.failures)
+                self.opened_at = time.monotonic()
+
+    def release_trial(self):
+        """End a call that neither succeeded nor failed, cancelled or broken on our side, so another trial can go"""
+        with self.lock:
+            self.trial_in_flight = False
+
+    @property
+    def state(self):
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return "open"
+            return "half-open"
+
+class ServiceClient:
+    """Pooled HTTP client for one downstream service"""
+    def __init__(self, name, connect_timeout, read_timeout, max_concurrency, max_retries,
+                 backoff, retry_on_timeout, failure_threshold, reset_timeout):
+        self.name = name
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.retry_on_timeout = retry_on_timeout
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        # Requests currently holding a slot
+        self.in_flight = 0
+        self.in_flight_lock = threading.Lock()
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+
+        # Keep-alive connections, enough of them for every concurrent caller
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @contextmanager
+    def slot(self):
+        with self.slots:
+            with self.in_flight_lock:
+                self.in_flight += 1
+            try:
+                yield
+            finally:
+                with self.in_flight_lock:
+                    self.in_flight -= 1
+
+    def should_retry(self, error):
+        if isinstance(error, requests.ConnectionError):
+            return True
+        if isinstance(error, requests.Timeout):
+            return self.retry_on_timeout
+        return isinstance(error, ServerError)
+
+    def post(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                with self.slot():
+                    response = self.session.post(url, **kwargs)
+                if response.status_code >= 500:
+                    raise ServerError(f"{self.name} returned status code {response.status_code}", response)
+                self.breaker.record_success()
+                return response
+            except (*SERVICE_ERRORS, ServerError) as e:
+                self.breaker.record_failure()
+                if attempt >= self.max_retries or not self.should_retry(e):
+                    if isinstance(e, ServerError):
+                        return e.response
+                    raise
+                # Full jitter, so callers failing together do not retry together
+                delay = random.uniform(0, self.backoff * (2 ** attempt))
+                attempt += 1
+                log_warning("%s request failed (%s), retry %s/%s in %.2fs", self.name, e, attempt, self.max_retries, delay)
+                time.sleep(delay)
+            except BaseException:
+                self.breaker.release_trial()
+                raise
+
+    @contextmanager
+    def stream(self, url, **kwargs):
+        """
+        Streaming POST, the concurrency slot is held until the caller is done reading.
+        Nothing is retried once the request went out, tokens may already have been relayed.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        self.breaker.before_call()
+        with self.slot():
+            try:
+                response = self.session.post(url, stream=True, **kwargs)
+            except SERVICE_ERRORS:
+                self.breaker.record_failure()
+                raise
+            except BaseException:
+                self.breaker.release_trial()
+                raise
+            if response.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            try:
+                yield response
+            finally:
+                # Closing the connection is what tells the llama server to stop generating
+                response.close()
+
+def service_client(name, prefix, read_timeout, max_concurrency, retry_on_timeout):
+    return ServiceClient(
+        name,
+        connect_timeout=float(os.environ.get(f'{prefix}_CONNECT_TIMEOUT', '5')),
+        read_timeout=float(os.environ.get(f'{prefix}_READ_TIMEOUT', str(read_timeout))),
+        max_concurrency=int(os.environ.get(f'{prefix}_MAX_CONCURRENCY', str(max_concurrency))),
+        max_retries=int(os.environ.get(f'{prefix}_MAX_RETRIES', '2')),
+        backoff=float(os.environ.get(f'{prefix}_RETRY_BACKOFF', '0.5')),
+        retry_on_timeout=retry_on_timeout,
+        failure_threshold=int(os.environ.get(f'{prefix}_CIRCUIT_FAILURES', '3')),
+        reset_timeout=float(os.environ.get(f'{prefix}_CIRCUIT_RESET_SECONDS', '30'))
+    )
+
+NOUGAT_ENDPOINTS = [
+    endpoint.strip()
+    for endpoint in os.environ.get('PDF_PARSER_ENDPOINT_PATH', 'http://localhost:8503/predict').split(',')
+    if endpoint.strip()
+]
+
+# A timed out generation keeps running on the llama server, retrying it would only queue a second copy
+llm_client = service_client('LLM service', 'LLM', read_timeout=600, max_concurrency=4, retry_on_timeout=False)
+# One client per Nougat instance, so a replica that is down only opens its own circuit
+nougat_clients = [
+    service_client(f'Nougat service at {endpoint}', 'NOUGAT', read_timeout=900, max_concurrency=2, retry_on_timeout=False)
+    for endpoint in NOUGAT_ENDPOINTS
+]
+embedding_client = service_client('Embedding service', 'EMBEDDING', read_timeout=60, max_concurrency=2, retry_on_timeout=True)
+tokenizer_client = service_client('Tokenizer service', 'TOKENIZER', read_timeout=30, max_concurrency=4, retry_on_timeout=True)
+
+for client in [llm_client, *nougat_clients, embedding_client, tokenizer_client]:
+    metrics.watch_client(client)
@@ -0,0 +1,132 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from models.data import data
+from models.jobs import (
+    jobs, STAGE_EXTRACTING_TEXT, STAGE_EXTRACTING_EVENTS, STAGE_DONE, STAGE_FAILED,
+    STATUS_RUNNING, STATUS_COMPLETED, STATUS_FAILED
+)
+from services.extraction import extract_text, extract_chunk_events, merge_chunk_events, bind_events
+from services.blob_store import blob_store
+from services.dedup import event_deduplicator
+from services.extraction_cache import extraction_cache
+from services.metrics import metrics
+from services.retrieval import build_index
+from utils import log_error, log_payload, log_warning
+
+INGESTION_WORKERS = int(os.environ.get('INGESTION_WORKERS', '2'))
+# Documents of one or more jobs that may be in flight at the same time
+INGESTION_DOCUMENT_WORKERS = int(os.environ.get('INGESTION_DOCUMENT_WORKERS', '8'))
+# Per stage limits, so a large batch cannot flood Nougat or the llama server
+TEXT_EXTRACTION_CONCURRENCY = int(os.environ.get('TEXT_EXTRACTION_CONCURRENCY', '2'))
+EVENT_EXTRACTION_CONCURRENCY = int(os.environ.get('EVENT_EXTRACTION_CONCURRENCY', '2'))
+
+executor = ThreadPoolExecutor(max_workers=INGESTION_WORKERS, thread_name_prefix='ingestion')
+document_executor = ThreadPoolExecutor(max_workers=INGESTION_DOCUMENT_WORKERS, thread_name_prefix='ingestion-document')
+
+text_extraction_slots = threading.BoundedSemaphore(TEXT_EXTRACTION_CONCURRENCY)
+event_extraction_slots = threading.BoundedSemaphore(EVENT_EXTRACTION_CONCURRENCY)
+
+def process_document(job_id, saved_file, case_id):
+    # Identical files share cache entries, so repeat uploads skip Nougat and the LLM
+    document_id, filename, document_type, file_path, content_hash = saved_file
+
+    text = extraction_cache.get_text(content_hash)
+    if text is None:
+        with text_extraction_slots:
+            jobs.set_stage(job_id, document_id, STAGE_EXTRACTING_TEXT)
+            with metrics.timer("text_extraction"):
+                text = extract_text(file_path, document_type)
+        if text:
+            extraction_cache.put_text(content_hash, text)
+    if not text:
+        raise Exception("There was no text in the file that was uploaded")
+
+    document = {
+        "id": document_id,
+        "caseId": case_id,
+        "name": filename,
+        "path": file_path,
+        "type": document_type,
+        "hash": content_hash,
+        "uploadDate": datetime.now().isoformat(),
+        "text": text
+    }
+    payloads = extraction_cache.get_events(content_hash)
+    complete = payloads is not None
+    if payloads is None:
+        with event_extraction_slots:
+            jobs.set_stage(job_id, document_id, STAGE_EXTRACTING_EVENTS)
+            with metrics.timer("event_extraction"):
+                chunk_events = extract_chunk_events(text)
+        payloads = merge_chunk_events(chunk_events)
+        # Events of the chunks that worked are stored, but a failed request must not become sticky
+        complete = None not in chunk_events
+        if payloads and complete:
+            extraction_cache.put_events(content_hash, payloads)
+    # The re-extraction queue picks up documents whose LLM stage failed, or found nothing
+    document["extractionVersion"] = extraction_cache.version if payloads and complete else None
+    events = bind_events(payloads, document_id, filename)
+    log_payload("ingestion.events", events, documentId=document_id)
+
+    # Events another document of the case already put on its timeline are merged into those
+    with metrics.timer("index_build"):
+        index = build_index(text, events)
+    with metrics.timer("store_document"):
+        data.add_document(document, events, index, event_deduplicator)
+
+    jobs.add_events(job_id, document_id, events)
+    jobs.set_stage(job_id, document_id, STAGE_DONE)
+
+def run_job(job_id, saved_files, case_id):
+    jobs.set_status(job_id, STATUS_RUNNING)
+    failed = 0
+    # Documents run side by side so one file's LLM call overlaps the next file's text extraction,
+    # results are collected in upload order
+    futures = [document_executor.submit(process_document, job_id, saved_file, case_id) for saved_file in saved_files]
+    for saved_file, future in zip(saved_files, futures):
+        try:
+            future.result()
+        except Exception as e:
+            log_error("Error processing document %s: %s", saved_file[1], e, jobId=job_id)
+            jobs.set_stage(job_id, saved_file[0], STAGE_FAILED, error=str(e))
+            # The document was never stored, its reference on the file goes with it
+            blob_store.release(saved_file[4])
+            failed += 1
+
+    jobs.set_status(job_id, STATUS_FAILED if failed == len(saved_files) else STATUS_COMPLETED)
+
+def submit_job(saved_files, case_id):
+    """Register a job adding the saved files to a case and hand it to the worker pool"""
+    job = jobs.create_job([
+        {"id": document_id, "name": filename, "type": document_type, "hash": content_hash}
+        for document_id, filename, document_type, _, content_hash in saved_files
+    ], case_id)
+    executor.submit(run_job, job["id"], saved_files, case_id)
+    return job
+
+def drain(timeout=None):
+    """
+    Stop taking new jobs and wait for the running and queued ones to finish, up to timeout
+    seconds. Returns whether everything finished.
+    """
+    finished = threading.Event()
+
+    def shutdown():
+        executor.shutdown(wait=True)
+        document_executor.shutdown(wait=True)
+        finished.set()
+
+    threading.Thread(target=shutdown, daemon=True).start()
+    return finished.wait(timeout)
+
+def recover_interrupted_jobs():
+    """Fail the jobs a stopped server left unfinished and release their files, run once before serving"""
+    blob_store.remove_partial_uploads()
+    hashes = jobs.fail_interrupted()
+    for content_hash in hashes:
+        blob_store.release(content_hash)
+    if hashes:
+        log_warning("Failed %s documents left unprocessed by the last shutdown", len(hashes))
@@ -0,0 +1,230 @@
+import os
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Set by gunicorn.conf.py, every worker writes its numbers there so /metrics on any worker covers all of them
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', '5'))
+
+# Seconds, from a SQLite write to a long Nougat run
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+HELP = {
+    "chronolaw_stage_duration_seconds": "Time spent in each stage of uploads, ingestion and chat",
+    "chronolaw_llm_duration_seconds": "Prompt processing (prefill) and generation time reported by the llama server",
+    "chronolaw_fallbacks_total": "Times a degraded path was taken, by kind",
+    "chronolaw_parse_failures_total": "Responses that could not be parsed, by kind",
+    "chronolaw_reextractions_total": "Stored documents re-extracted in the background, by result",
+    "chronolaw_extraction_cache_total": "Extraction cache lookups, by kind (text or events) and result (hit or miss)",
+    "chronolaw_extraction_cache_evictions_total": "Entries evicted from the extraction cache",
+    "chronolaw_downstream_in_flight": "Requests currently in flight to each downstream service",
+    "chronolaw_downstream_circuit_open": "Processes in which the circuit breaker of a downstream service is open",
+}
+TYPES = {
+    "chronolaw_stage_duration_seconds": "histogram",
+    "chronolaw_llm_duration_seconds": "histogram",
+    "chronolaw_fallbacks_total": "counter",
+    "chronolaw_parse_failures_total": "counter",
+    "chronolaw_reextractions_total": "counter",
+    "chronolaw_extraction_cache_total": "counter",
+    "chronolaw_extraction_cache_evictions_total": "counter",
+    "chronolaw_downstream_in_flight": "gauge",
+    "chronolaw_downstream_circuit_open": "gauge",
+}
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in pairs) + "}"
+
+class Metrics:
+    """
+    Histograms, counters and gauges rendered in the Prometheus text format. Under
+    gunicorn each worker flushes its numbers to METRICS_DIR, and rendering adds up
+    the files of every worker. Counters of exited workers keep counting, gauges only
+    come from workers that flushed recently.
+    """
+    def __init__(self, directory, flush_seconds):
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self.histograms = {}
+        self.counters = {}
+        # (name, labels, callback) of the gauges, read when rendering
+        self.gauges = []
+        self.lock = threading.Lock()
+        self.flusher = None
+        # Lists collecting every observation while a recording() block is open
+        self.recorders = []
+
+    def observe(self, name, seconds, **labels):
+        key = (name, label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+            index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+            if index < len(LATENCY_BUCKETS):
+                histogram["buckets"][index] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+            for recorder in self.recorders:
+                recorder.append((name, dict(labels), seconds))
+        self.start_flusher()
+
+    @contextmanager
+    def recording(self):
+        """Yields a list of the (name, labels, seconds) observed inside the block, for exact percentiles"""
+        recorder = []
+        with self.lock:
+            self.recorders.append(recorder)
+        try:
+            yield recorder
+        finally:
+            with self.lock:
+                self.recorders.remove(recorder)
+
+    @contextmanager
+    def timer(self, stage):
+        """Observe the time spent in the with block as chronolaw_stage_duration_seconds{stage=...}"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("chronolaw_stage_duration_seconds", time.perf_counter() - start, stage=stage)
+
+    def observe_llm_timings(self, task, response_json):
+        """Prefill and generation time from the timings the llama server adds to its responses"""
+        timings = response_json.get('timings') if isinstance(response_json, dict) else None
+        if not timings:
+            return
+        if timings.get('prompt_ms') is not None:
+            self.observe("chronolaw_llm_duration_seconds", timings['prompt_ms'] / 1000, task=task, phase="prefill")
+        if timings.get('predicted_ms') is not None:
+            self.observe("chronolaw_llm_duration_seconds", timings['predicted_ms'] / 1000, task=task, phase="generation")
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+        self.start_flusher()
+
+    def gauge(self, name, callback, **labels):
+        self.gauges.append((name, label_key(labels), callback))
+
+    def watch_client(self, client):
+        """In-flight and circuit gauges of a ServiceClient or AsyncServiceClient"""
+        self.gauge("chronolaw_downstream_in_flight", lambda: client.in_flight, service=client.name)
+        self.gauge("chronolaw_downstream_circuit_open", lambda: int(client.breaker.state == "open"), service=client.name)
+
+    def snapshot(self):
+        with self.lock:
+            histograms = [
+                [name, labels, list(histogram["buckets"]), histogram["sum"], histogram["count"]]
+                for (name, labels), histogram in self.histograms.items()
+            ]
+            counters = [[name, labels, value] for (name, labels), value in self.counters.items()]
+        gauges = [[name, labels, callback()] for name, labels, callback in self.gauges]
+        return {"histograms": histograms, "counters": counters, "gauges": gauges}
+
+    def start_flusher(self):
+        if not self.directory or self.flusher is not None:
+            return
+        with self.lock:
+            if self.flusher is not None:
+                return
+            self.flusher = threading.Thread(target=self.flush_periodically, name='metrics-flush', daemon=True)
+            self.flusher.start()
+
+    def flush_periodically(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            self.flush()
+
+    def flush(self):
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"metrics-{os.getpid()}.json")
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(f"{path}.tmp", path)
+
+    def process_snapshots(self):
+        """This process's live numbers, then those other workers last flushed, with whether they are recent"""
+        snapshots = [(self.snapshot(), True)]
+        if not self.directory or not os.path.isdir(self.directory):
+            return snapshots
+        own = f"metrics-{os.getpid()}.json"
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.json') or filename == own:
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                recent = time.time() - os.path.getmtime(path) < self.flush_seconds * 3
+                with open(path) as f:
+                    snapshots.append((json.load(f), recent))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def counter_totals(self, name):
+        """{labels: value} of a counter, added up over every worker"""
+        totals = {}
+        for snapshot, _ in self.process_snapshots():
+            for metric, labels, value in snapshot["counters"]:
+                if metric == name:
+                    key = tuple(map(tuple, labels))
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def render(self):
+        histograms = {}
+        counters = {}
+        gauges = {}
+        for snapshot, recent in self.process_snapshots():
+            for name, labels, buckets, total, count in snapshot["histograms"]:
+                key = (name, tuple(map(tuple, labels)))
+                merged = histograms.setdefault(key, [[0] * len(LATENCY_BUCKETS), 0.0, 0])
+                merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+                merged[1] += total
+                merged[2] += count
+            for name, labels, value in snapshot["counters"]:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            if recent:
+                for name, labels, value in snapshot["gauges"]:
+                    key = (name, tuple(map(tuple, labels)))
+                    gauges[key] = gauges.get(key, 0) + value
+
+        lines = []
+        for name in HELP:
+            lines.append(f"# HELP {name} {HELP[name]}")
+            lines.append(f"# TYPE {name} {TYPES[name]}")
+            for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket in zip(LATENCY_BUCKETS, buckets):
+                    cumulative += bucket
+                    lines.append(f"{name}_bucket{format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_bucket{format_labels(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {total}")
+                lines.append(f"{name}_count{format_labels(labels)} {count}")
+            for values in (counters, gauges):
+                for (metric, labels), value in sorted(values.items()):
+                    if metric == name:
+                        lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+# Create a singleton instance
+metrics = Metrics(METRICS_DIR, METRICS_FLUSH_SECONDS)
@@ -0,0 +1,61 @@
+import os
+import unicodedata
+import pymupdf
+
+# A page with less text than this is treated as scanned
+PDF_MIN_PAGE_CHARS = int(os.environ.get('PDF_MIN_PAGE_CHARS', '200'))
+# Share of replacement, control and private use characters above which the text layer is unusable
+PDF_MAX_GARBAGE_RATIO = float(os.environ.get('PDF_MAX_GARBAGE_RATIO', '0.1'))
+# Pages mostly covered by images only keep their text layer when it is substantial
+PDF_MAX_IMAGE_COVERAGE = float(os.environ.get('PDF_MAX_IMAGE_COVERAGE', '0.6'))
+PDF_IMAGE_PAGE_MIN_CHARS = PDF_MIN_PAGE_CHARS * 5
+
+def garbage_ratio(text):
+    characters = [c for c in text if not c.isspace()]
+    if not characters:
+        return 0.0
+    garbage = sum(
+        1 for c in characters
+        if c == '\ufffd' or unicodedata.category(c) in ('Cc', 'Co', 'Cn', 'Cs')
+    )
+    return garbage / len(characters)
+
+def image_coverage(page):
+    page_area = page.rect.width * page.rect.height
+    if not page_area:
+        return 0.0
+    covered = 0.0
+    for image in page.get_image_info():
+        bbox = page.rect & pymupdf.Rect(image['bbox'])
+        if not bbox.is_empty:
+            covered += bbox.width * bbox.height
+    return min(covered / page_area, 1.0)
+
+def score_page(page):
+    """Text layer of a pymupdf page, with the quality measures that decide whether it needs OCR"""
+    text = page.get_text()
+    chars = len(text.strip())
+    garbage = garbage_ratio(text)
+    coverage = image_coverage(page)
+    needs_ocr = (
+        chars < PDF_MIN_PAGE_CHARS
+        or garbage > PDF_MAX_GARBAGE_RATIO
+        or (coverage > PDF_MAX_IMAGE_COVERAGE and chars < PDF_IMAGE_PAGE_MIN_CHARS)
+    )
+    return {
+        "text": text,
+        "chars": chars,
+        "garbageRatio": garbage,
+        "imageCoverage": coverage,
+        "needsOcr": needs_ocr
+    }
+
+def page_ranges(page_numbers):
+    """Contiguous (start, stop) runs of 1-based page numbers, stop included as Nougat expects"""
+    ranges = []
+    for number in sorted(page_numbers):
+        if ranges and ranges[-1][1] == number - 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return [tuple(page_range) for page_range in ranges]
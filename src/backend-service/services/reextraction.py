@@ -0,0 +1,157 @@
+"""
+Background re-extraction of stored documents whose events came from an older extraction
+version, after the prompt, the schema, the chunking or the model changed. Only the LLM
+stage runs again, on the text stored at upload time.
+"""
+import os
+import time
+import threading
+
+from models.data import data
+from services.dedup import event_deduplicator
+from services.extraction import bind_events, extract_events_from_chunk, extraction_prompts, merge_chunk_events
+from services.extraction_cache import extraction_cache
+from services.http_client import llm_client
+from services.metrics import metrics
+from services.retrieval import build_index
+from utils import log_error, log_message, log_warning
+
+REEXTRACTION_ENABLED = os.environ.get('REEXTRACTION_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# A chunk request is only sent once this process had no LLM request in flight for this long
+REEXTRACTION_IDLE_SECONDS = float(os.environ.get('REEXTRACTION_IDLE_SECONDS', '2'))
+# How often to look for stale documents when there are none
+REEXTRACTION_POLL_SECONDS = float(os.environ.get('REEXTRACTION_POLL_SECONDS', '60'))
+# A document claimed by a worker that died is taken again after this
+REEXTRACTION_LEASE_SECONDS = float(os.environ.get('REEXTRACTION_LEASE_SECONDS', '1800'))
+
+class ReextractionQueue:
+    """
+    One low priority thread per process. Documents are claimed in the database, so only
+    one is re-extracted at a time across all workers, and its chunks go to the llama server
+    one by one, each waiting until chat and uploads in this process leave the LLM idle.
+    """
+    def __init__(self, idle_seconds, poll_seconds, lease_seconds):
+        self.idle_seconds = idle_seconds
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self.stopping = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+        # Clients whose requests the queue gives way to
+        self.clients = [llm_client]
+
+    def watch(self, client):
+        """Also wait for the requests of client, the ASGI app's async LLM client"""
+        self.clients.append(client)
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.run, name='reextraction', daemon=True)
+            self.thread.start()
+
+    def stop(self, timeout=None):
+        """Stop after the current chunk request, the document being worked on is given back"""
+        self.stopping.set()
+        thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+        self.thread = None
+
+    def wait_for_idle_llm(self):
+        """Block until no LLM request was in flight for idle_seconds, False when stopping"""
+        idle_since = time.monotonic()
+        while not self.stopping.is_set():
+            if any(client.in_flight for client in self.clients):
+                idle_since = time.monotonic()
+            elif time.monotonic() - idle_since >= self.idle_seconds:
+                return True
+            self.stopping.wait(0.25)
+        return False
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                worked = self.run_once()
+            except Exception as e:
+                log_error("Error in background re-extraction: %s", e)
+                worked = False
+            if not worked:
+                self.stopping.wait(self.poll_seconds)
+
+    def llm_available(self):
+        return all(client.breaker.state == "closed" for client in self.clients)
+
+    def run_once(self):
+        """Re-extract one stale document, returns whether there was one and the next can follow right away"""
+        # A llama server that is down or restarting, often right after a model switch, is waited out
+        if not self.llm_available():
+            return False
+        version = extraction_cache.version
+        document = data.claim_stale_extraction(version, self.lease_seconds)
+        if document is None:
+            return False
+
+        try:
+            payloads = self.extract(document)
+            if payloads is None:
+                # Stopped, or a chunk request failed: the document is taken again after the poll interval
+                data.release_extraction(document["id"])
+                return False
+
+            # Every chunk was answered, but never swap stored events for an empty result
+            if not payloads:
+                log_warning("Re-extraction of %s found no events, keeping the stored ones", document["name"],
+                            documentId=document["id"])
+                metrics.increment("chronolaw_reextractions_total", result="failed")
+                data.fail_extraction(document["id"], version, "No events were extracted")
+                return True
+
+            events = bind_events(payloads, document["id"], document["name"])
+            # Text and passages are unchanged, only the events get new index entries
+            with metrics.timer("index_build"):
+                index = build_index(None, events)
+            data.replace_events(document["id"], events, index, event_deduplicator, version)
+        except Exception as e:
+            log_error("Error re-extracting %s: %s", document["name"], e, documentId=document["id"])
+            metrics.increment("chronolaw_reextractions_total", result="failed")
+            data.fail_extraction(document["id"], version, str(e))
+            return True
+
+        metrics.increment("chronolaw_reextractions_total", result="updated")
+        log_message("Re-extracted %s, %s events", document["name"], len(events),
+                    documentId=document["id"], extractionVersion=version)
+        return True
+
+    def extract(self, document):
+        """Event payloads of the document's stored text, None when stopped or when any chunk failed"""
+        if document.get("hash"):
+            payloads = extraction_cache.get_events(document["hash"])
+            if payloads is not None:
+                return payloads
+
+        with metrics.timer("reextraction"):
+            chunk_events = []
+            for prompt in extraction_prompts(document["text"] or ""):
+                if not self.wait_for_idle_llm() or not self.llm_available():
+                    return None
+                events = extract_events_from_chunk(prompt)
+                if events is None:
+                    log_warning("Re-extraction of %s stopped at a failed LLM request, retrying later", document["name"],
+                                documentId=document["id"])
+                    return None
+                chunk_events.append(events)
+            payloads = merge_chunk_events(chunk_events)
+
+        if payloads and document.get("hash"):
+            extraction_cache.put_events(document["hash"], payloads)
+        return payloads
+
+# Create a singleton instance
+reextraction_queue = ReextractionQueue(REEXTRACTION_IDLE_SECONDS, REEXTRACTION_POLL_SECONDS, REEXTRACTION_LEASE_SECONDS)
+
+def start_reextraction():
+    if REEXTRACTION_ENABLED:
+        reextraction_queue.start()
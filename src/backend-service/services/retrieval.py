@@ -0,0 +1,166 @@
+import os
+import re
+import math
+from array import array
+
+from models.data import data
+from services.chunking import chunk_text
+from services.dates import UNDATED_SORT_KEY
+from services.http_client import embedding_client
+from services.metrics import metrics
+from services.tokens import token_counter
+from utils import log_message, log_warning
+
+RETRIEVAL_TOP_K_EVENTS = int(os.environ.get('RETRIEVAL_TOP_K_EVENTS', '30'))
+RETRIEVAL_TOP_K_PASSAGES = int(os.environ.get('RETRIEVAL_TOP_K_PASSAGES', '4'))
+RETRIEVAL_PASSAGE_TOKENS = int(os.environ.get('RETRIEVAL_PASSAGE_TOKENS', '200'))
+CHAT_CONTEXT_TOKENS = int(os.environ.get('CHAT_CONTEXT_TOKENS', '3000'))
+# Optional OpenAI style /v1/embeddings endpoint, BM25 results are reranked with it when set
+EMBEDDING_ENDPOINT = os.environ.get('EMBEDDING_ENDPOINT_PATH')
+# BM25 candidates handed to the embedding reranker per requested result
+EMBEDDING_CANDIDATE_FACTOR = 3
+
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'did', 'do', 'does', 'for', 'from', 'had', 'has',
+    'have', 'how', 'i', 'in', 'is', 'it', 'of', 'on', 'or', 'that', 'the', 'this', 'to', 'was', 'were',
+    'what', 'when', 'where', 'which', 'who', 'why', 'with'
+}
+
+def search_terms(text):
+    return [term for term in re.findall(r'\w+', text.lower()) if term not in STOPWORDS]
+
+def match_query(text):
+    """FTS5 query matching any of the terms of text, quoted so user input cannot inject syntax"""
+    terms = list(dict.fromkeys(search_terms(text)))
+    if not terms:
+        return None
+    return " OR ".join(f'"{term}"' for term in terms)
+
+def event_search_text(event):
+    participants = event.get('participants') or []
+    if not isinstance(participants, list):
+        participants = [participants]
+    return "\n".join(str(part) for part in [
+        event.get('title', ''),
+        event.get('date', ''),
+        event.get('description', ''),
+        ", ".join(str(participant) for participant in participants),
+        event.get('location', ''),
+        event.get('context', ''),
+        event.get('document', '')
+    ] if part)
+
+def embed(texts):
+    """Embedding vectors packed as float32 bytes, or None when no embedding backend is configured"""
+    if not EMBEDDING_ENDPOINT or not texts:
+        return None
+    try:
+        response = embedding_client.post(
+            EMBEDDING_ENDPOINT,
+            headers={'Content-Type': 'application/json'},
+            json={"input": texts}
+        )
+        response.raise_for_status()
+        items = sorted(response.json()['data'], key=lambda item: item['index'])
+        return [array('f', item['embedding']).tobytes() for item in items]
+    except Exception as e:
+        log_warning("Error computing embeddings, continuing with BM25 only: %s", e)
+        metrics.increment("chronolaw_fallbacks_total", kind="embedding_unavailable")
+        return None
+
+def cosine(a, b):
+    a = array('f', a)
+    b = array('f', b)
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+def build_index(text, events):
+    """Retrieval entries for a document, stored by Data.add_document at ingestion time"""
+    event_texts = [event_search_text(event) for event in events]
+    passages = chunk_text(text, RETRIEVAL_PASSAGE_TOKENS, RETRIEVAL_PASSAGE_TOKENS // 10) if text else []
+    return {
+        "events": event_texts,
+        "passages": passages,
+        "eventVectors": embed(event_texts),
+        "passageVectors": embed(passages)
+    }
+
+def rank(kind, question_vector, results, limit):
+    """Reorder BM25 results by embedding similarity to the question when vectors are available"""
+    if question_vector is None:
+        return results[:limit]
+    vectors = data.get_embeddings(kind, [ref for ref, _, _ in results])
+    return sorted(
+        results,
+        key=lambda result: -cosine(question_vector, vectors[result[0]]) if result[0] in vectors else 1.0
+    )[:limit]
+
+def passage_text(passage):
+    return passage['content']
+
+def retrieve_context(question, case_id, token_budget=CHAT_CONTEXT_TOKENS, format_event=event_search_text, format_passage=passage_text,
+                     exclude_event_ids=()):
+    """
+    The events and passages of a case most relevant to the question that fit in token_budget,
+    measured on the text format_event and format_passage render them as. Events in
+    exclude_event_ids, already part of the prompt, are skipped.
+    Events come back in timeline order, passages in relevance order. When the question
+    matches fewer events than the budget allows, the earliest events fill the rest.
+    """
+    match = match_query(question)
+    question_vectors = embed([question])
+    question_vector = question_vectors[0] if question_vectors else None
+    factor = EMBEDDING_CANDIDATE_FACTOR if question_vector is not None else 1
+
+    event_results = data.search_events(case_id, match, RETRIEVAL_TOP_K_EVENTS * factor) if match else []
+    passage_results = data.search_passages(case_id, match, RETRIEVAL_TOP_K_PASSAGES * factor) if match else []
+    event_results = rank('event', question_vector, event_results, RETRIEVAL_TOP_K_EVENTS)
+    passage_results = rank('passage', question_vector, passage_results, RETRIEVAL_TOP_K_PASSAGES)
+
+    matched_events = [event for _, event, _ in event_results if event['id'] not in exclude_event_ids]
+    matched_passages = [passage for _, passage, _ in passage_results]
+    fill_events = []
+    if len(matched_events) < RETRIEVAL_TOP_K_EVENTS:
+        selected = {event['id'] for event in matched_events} | set(exclude_event_ids)
+        fill_events = [
+            event for event in data.get_timeline_events(case_id, RETRIEVAL_TOP_K_EVENTS * 2)
+            if event['id'] not in selected
+        ][:RETRIEVAL_TOP_K_EVENTS - len(matched_events)]
+
+    # One tokenizer round trip for every candidate
+    costs = token_counter.count_many(
+        [format_event(event) for event in matched_events] +
+        [format_passage(passage) for passage in matched_passages] +
+        [format_event(event) for event in fill_events]
+    )
+    event_costs = costs[:len(matched_events)]
+    passage_costs = costs[len(matched_events):len(matched_events) + len(matched_passages)]
+    fill_costs = costs[len(matched_events) + len(matched_passages):]
+
+    events = []
+    passages = []
+    used = 0
+
+    # Events are denser than raw passages, they get first claim on the budget
+    for event, cost in zip(matched_events, event_costs):
+        if used + cost > token_budget:
+            break
+        events.append(event)
+        used += cost
+    for passage, cost in zip(matched_passages, passage_costs):
+        if used + cost > token_budget:
+            break
+        passages.append(passage)
+        used += cost
+    for event, cost in zip(fill_events, fill_costs):
+        if used + cost > token_budget:
+            break
+        events.append(event)
+        used += cost
+
+    events.sort(key=lambda event: event.get('dateKey', UNDATED_SORT_KEY))
+    log_message(
+        "Retrieved %s events and %s passages, %s of %s context tokens", len(events), len(passages), used, token_budget
+    )
+    return events, passages
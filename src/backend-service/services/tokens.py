@@ -0,0 +1,93 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+from services.chunking import estimate_tokens
+from services.http_client import tokenizer_client
+from services.metrics import metrics
+from utils import log_message, log_warning
+
+LLM_ENDPOINT = os.environ.get('LLM_ENDPOINT_PATH', "http://localhost:8080/answer")
+LLM_TOKENIZE_ENDPOINT = os.environ.get('LLM_TOKENIZE_ENDPOINT_PATH', LLM_ENDPOINT.rsplit('/', 1)[0] + '/tokenize')
+# Context of one llama server slot, that is --ctx-size divided by --parallel
+LLM_CONTEXT_SIZE = int(os.environ.get('LLM_CONTEXT_SIZE', '8192'))
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', '8192'))
+# Headroom for the tokens the server adds around a prompt
+PROMPT_MARGIN_TOKENS = 16
+
+class PromptTooLargeError(Exception):
+    """The prompt leaves less room for the answer than the request needs"""
+
+class TokenCounter:
+    """
+    Counts tokens with the llama server's own tokenizer through its batch /tokenize
+    endpoint, remembering counts of recently seen texts. Falls back to the character
+    estimate while the server is unreachable, those estimates are not cached.
+    """
+    def __init__(self, endpoint, cache_size):
+        self.endpoint = endpoint
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def count_many(self, texts):
+        keys = [hashlib.sha1(text.encode('utf-8')).digest() for text in texts]
+        counts = [None] * len(texts)
+        with self.lock:
+            for i, key in enumerate(keys):
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+                    counts[i] = self.cache[key]
+
+        missing = [i for i, count in enumerate(counts) if count is None]
+        if not missing:
+            return counts
+
+        try:
+            response = tokenizer_client.post(
+                self.endpoint,
+                headers={'Content-Type': 'application/json'},
+                json={"content": [texts[i] for i in missing], "add_special": True, "batch": True}
+            )
+            response.raise_for_status()
+            token_lists = response.json()['tokens']
+        except Exception as e:
+            log_warning("Error counting tokens, using estimates: %s", e)
+            metrics.increment("chronolaw_fallbacks_total", kind="token_estimate")
+            for i in missing:
+                counts[i] = estimate_tokens(texts[i])
+            return counts
+
+        with self.lock:
+            for i, tokens in zip(missing, token_lists):
+                counts[i] = len(tokens)
+                self.cache[keys[i]] = counts[i]
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return counts
+
+    def count(self, text):
+        return self.count_many([text])[0]
+
+def plan_request(prompt_tokens, max_output_tokens, min_output_tokens=1, label="request"):
+    """
+    n_predict for a prompt of prompt_tokens: up to max_output_tokens, never past the end
+    of the context. Raises PromptTooLargeError when fewer than min_output_tokens remain.
+    """
+    available = LLM_CONTEXT_SIZE - prompt_tokens - PROMPT_MARGIN_TOKENS
+    n_predict = min(max_output_tokens, available)
+    # Logged at INFO, it is what LLM_CONTEXT_SIZE and the output budgets are tuned from
+    log_message(
+        "Token budget for %s", label,
+        promptTokens=prompt_tokens, nPredict=n_predict, contextSize=LLM_CONTEXT_SIZE, unused=max(available - n_predict, 0)
+    )
+    if n_predict < min_output_tokens:
+        raise PromptTooLargeError(
+            f"Prompt of {prompt_tokens} tokens leaves {max(n_predict, 0)} of the {min_output_tokens} tokens "
+            f"needed for the answer in a context of {LLM_CONTEXT_SIZE}"
+        )
+    return n_predict
+
+# Create a singleton instance
+token_counter = TokenCounter(LLM_TOKENIZE_ENDPOINT, TOKEN_CACHE_SIZE)
@@ -1,21 +1,131 @@
 import os
+import sys
+import time
 import pathlib
 import json
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timezone
 
 def get_file_path(filename):
     """Get the absolute path for a file relative to the current directory"""
     current_dir = pathlib.Path(__file__).parent.absolute()
     return os.path.join(current_dir, filename)
 
-def log_message(message, prefix=""):
-    """Log a message with a prefix"""
-    if prefix:
-        print(f"[LOG] ========{prefix}========")
-        print(f"[LOG] {message}")
-        print(f"[LOG] ========{prefix}========")
-    else:
-        print(f"[LOG] {message}")
-        
+CROCKFORD_BASE32 = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_id_lock = threading.Lock()
+_last_id = [0, 0]
+
+def sortable_id():
+    """
+    ULID style identifier: 48 bits of milliseconds then 80 random bits, in Crockford base32.
+    Ids sort by creation time, and ids made in the same millisecond increment the random
+    part so they still sort in creation order and cannot collide.
+    """
+    with _id_lock:
+        millis = int(time.time() * 1000)
+        if millis <= _last_id[0]:
+            millis = _last_id[0]
+            randomness = _last_id[1] + 1
+        else:
+            randomness = int.from_bytes(os.urandom(10), 'big')
+        _last_id[0], _last_id[1] = millis, randomness
+
+    value = (millis << 80) | (randomness & ((1 << 80) - 1))
+    return "".join(CROCKFORD_BASE32[(value >> shift) & 31] for shift in range(125, -1, -5))
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# json for JSON lines, text for plain lines while developing
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+# Document text, prompts and LLM output are cut to this many characters
+LOG_PAYLOAD_MAX_CHARS = int(os.environ.get('LOG_PAYLOAD_MAX_CHARS', '2000'))
+# Recent payloads kept in memory for /api/debug/payloads whatever the log level, 0 turns it off
+LOG_DEBUG_BUFFER_SIZE = int(os.environ.get('LOG_DEBUG_BUFFER_SIZE', '100'))
+
+class JsonLineFormatter(logging.Formatter):
+    """One JSON object per line, with the fields passed to log_message next to the message"""
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+            **getattr(record, 'fields', {})
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = getattr(record, 'fields', {})
+        line = f"[{record.levelname}] {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+logger = logging.getLogger('chronolaw')
+logger.setLevel(LOG_LEVEL)
+logger.propagate = False
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(JsonLineFormatter() if LOG_FORMAT == 'json' else TextFormatter())
+    logger.addHandler(_handler)
+
+debug_payloads = deque(maxlen=max(LOG_DEBUG_BUFFER_SIZE, 1))
+_debug_payloads_lock = threading.Lock()
+
+def log_message(message, *args, level=logging.INFO, **fields):
+    """
+    Log message % args at level, keyword arguments become fields of the JSON line.
+    Nothing is formatted when the level is disabled, so pass values as args rather
+    than building the string up front in hot paths.
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, message, *args, extra={"fields": fields})
+
+def log_debug(message, *args, **fields):
+    log_message(message, *args, level=logging.DEBUG, **fields)
+
+def log_warning(message, *args, **fields):
+    log_message(message, *args, level=logging.WARNING, **fields)
+
+def log_error(message, *args, **fields):
+    log_message(message, *args, level=logging.ERROR, **fields)
+
+def truncate_payload(payload, max_chars=LOG_PAYLOAD_MAX_CHARS):
+    text = payload if isinstance(payload, str) else json.dumps(payload, default=str)
+    if len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}... [{len(text) - max_chars} more characters]"
+
+def log_payload(label, payload, **fields):
+    """
+    A large payload (document text, prompt, LLM output) under label. It is truncated,
+    kept in the debug ring buffer and logged at DEBUG level only.
+    """
+    if LOG_DEBUG_BUFFER_SIZE > 0:
+        # Cutting a string only copies the kept part, anything else is serialized when the buffer is read
+        kept = truncate_payload(payload) if isinstance(payload, str) else payload
+        entry = {"time": datetime.now(timezone.utc).isoformat(timespec='milliseconds'), "label": label, **fields, "payload": kept}
+        with _debug_payloads_lock:
+            debug_payloads.append(entry)
+    if logger.isEnabledFor(logging.DEBUG):
+        log_debug(label, **fields, payload=truncate_payload(payload))
+
+def recent_payloads(label=None):
+    """Payloads in the debug ring buffer, oldest first, optionally only those with a label"""
+    with _debug_payloads_lock:
+        entries = list(debug_payloads) if LOG_DEBUG_BUFFER_SIZE > 0 else []
+    return [
+        entry if isinstance(entry["payload"], str) else {**entry, "payload": truncate_payload(entry["payload"])}
+        for entry in entries if label is None or entry["label"] == label
+    ]
+
+
 def document_extraction_prompt(text):
     return f"""
         Extract events from the provided text and return them in the following JSON format. Make sure to strictly use information from the text for each field.
@@ -19,7 +19,6 @@ import {
   AlertDescription
 } from '@chakra-ui/react';
 import { ArrowUpIcon } from '@chakra-ui/icons';
-import axios from 'axios';
 
 const SERVER_URL = process.env.REACT_APP_SERVER_URL;
 
@@ -29,6 +28,8 @@ const Chat = ({ timelineEvents }) => {
   const [isLoading, setIsLoading] = useState(false);
   const [error, setError] = useState(null);
   const messagesEndRef = useRef(null);
+  // Lets the server send every question of this conversation to the same LLM slot
+  const sessionIdRef = useRef(Date.now().toString(36) + Math.random().toString(36).slice(2));
 
   const userBgColor = useColorModeValue('brand.100', 'brand.900');
   const botBgColor = useColorModeValue('gray.100', 'gray.700');
@@ -67,23 +68,71 @@ const Chat = ({ timelineEvents }) => {
     setInput('');
     setIsLoading(true);
     setError(null);
+    let answerStarted = false;
 
     try {
-      const response = await axios.post(SERVER_URL + '/api/chat/receive', { message: input });
+      // Stream the answer so tokens show up as soon as the model produces them
+      const response = await fetch(SERVER_URL + '/api/chat/receive/stream', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ message: input, sessionId: sessionIdRef.current })
+      });
 
-      const botMessage = {
-        sender: 'bot',
-        text: response.data.response
-      };
+      if (!response.ok) {
+        const body = await response.json().catch(() => ({}));
+        throw new Error(body.message || 'An error occurred while processing your message. Please try again.');
+      }
 
-      setMessages(prev => [...prev, botMessage]);
+      setMessages(prev => [...prev, { sender: 'bot', text: '' }]);
+      answerStarted = true;
+      setIsLoading(false);
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let done = false;
+
+      while (!done) {
+        const { value, done: readerDone } = await reader.read();
+        if (readerDone) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+
+        for (const event of events) {
+          if (!event.startsWith('data: ')) continue;
+          const payload = JSON.parse(event.slice('data: '.length));
+
+          if (payload.error) throw new Error(payload.error);
+          if (payload.stop) {
+            done = true;
+            break;
+          }
+          if (payload.content) {
+            setMessages(prev => [
+              ...prev.slice(0, -1),
+              { ...prev[prev.length - 1], text: prev[prev.length - 1].text + payload.content }
+            ]);
+          }
+        }
+      }
+      // The server ends every answer with a stop event, without one the stream broke off
+      if (!done) throw new Error('The connection closed before the answer was complete.');
     } catch (error) {
       console.error('Error sending message:', error);
 
-      setError(
-        error.response?.data?.message ||
-        'An error occurred while processing your message. Please try again.'
-      );
+      const errorMessage = error.message ||
+        'An error occurred while processing your message. Please try again.';
+      if (answerStarted) {
+        // Mark the answer that broke off in its own bubble, rather than leaving it blank or cut short
+        setMessages(prev => [
+          ...prev.slice(0, -1),
+          { ...prev[prev.length - 1], error: errorMessage }
+        ]);
+      } else {
+        setError(errorMessage);
+      }
     } finally {
       setIsLoading(false);
     }
@@ -149,7 +198,14 @@ const Chat = ({ timelineEvents }) => {
                         borderRadius="lg"
                       >
                         <CardBody py={2} px={3}>
-                          <Text whiteSpace="pre-wrap">{message.text}</Text>
+                          {message.text && (
+                            <Text whiteSpace="pre-wrap">{message.text}</Text>
+                          )}
+                          {message.error && (
+                            <Text color="red.500" fontSize="sm" mt={message.text ? 2 : 0}>
+                              {message.text ? 'The answer was cut off: ' : ''}{message.error}
+                            </Text>
+                          )}
                         </CardBody>
                       </Card>
 
@@ -20,6 +20,7 @@ import { useDropzone } from 'react-dropzone';
 import axios from 'axios';
 
 const SERVER_URL = process.env.REACT_APP_SERVER_URL;
+const JOB_POLL_INTERVAL = 2000;
 
 const DocumentUpload = ({ onDocumentsProcessed, setIsLoading }) => {
   const [files, setFiles] = useState([]);
@@ -83,6 +84,21 @@ const DocumentUpload = ({ onDocumentsProcessed, setIsLoading }) => {
           'Content-Type': 'multipart/form-data'
         }
       });
+
+      // Processing happens in the background, poll the job until it has finished
+      const jobId = response.data.jobId;
+      let job = response.data.job;
+      while (job.status === 'queued' || job.status === 'running') {
+        await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL));
+        job = (await axios.get(`${SERVER_URL}/api/documents/jobs/${jobId}`)).data;
+      }
+
+      if (job.status === 'failed') {
+        const failedDocument = job.documents.find(document => document.error);
+        throw new Error(failedDocument?.error || 'None of the documents could be processed.');
+      }
+
+      const result = await axios.get(`${SERVER_URL}/api/documents/jobs/${jobId}/events`);
       
       toast({
         title: 'Upload successful',
@@ -96,13 +112,13 @@ const DocumentUpload = ({ onDocumentsProcessed, setIsLoading }) => {
       setFiles([]);
       
       // Pass the processed data to the parent component
-      onDocumentsProcessed(response.data);
+      onDocumentsProcessed(result.data);
     } catch (error) {
       setIsLoading(false);
       
       toast({
         title: 'Upload failed',
-        description: error.response?.data?.message || 'An error occurred while processing the documents.',
+        description: error.response?.data?.message || error.message || 'An error occurred while processing the documents.',
         status: 'error',
         duration: 5000,
         isClosable: true,
@@ -4610,7 +4610,16 @@ int main(int argc, char **argv)
         const json body = json::parse(req.body);
 
         json tokens_response = json::array();
-        if (body.count("content") != 0)
+        if (body.count("content") != 0 && json_value(body, "batch", false))
+        {
+            // one token list per string, so callers can size many prompts in a single request
+            const bool add_special = json_value(body, "add_special", false);
+            for (const auto &item : body.at("content"))
+            {
+                tokens_response.push_back(tokenize_mixed(ctx_server.vocab, item, add_special, true));
+            }
+        }
+        else if (body.count("content") != 0)
         {
             const bool add_special = json_value(body, "add_special", false);
             const bool with_pieces = json_value(body, "with_pieces", false);
@@ -4998,8 +5007,8 @@ int main(int argc, char **argv)
     // svr->Post("/reranking", handle_rerank);
     // svr->Post("/v1/rerank", handle_rerank);
     // svr->Post("/v1/reranking", handle_rerank);
-    // svr->Post("/tokenize", handle_tokenize);
-    // svr->Post("/detokenize", handle_detokenize);
+    svr->Post("/tokenize", handle_tokenize);
+    svr->Post("/detokenize", handle_detokenize);
     // // LoRA adapters hotswap
     // svr->Get("/lora-adapters", handle_lora_adapters_list);
     // svr->Post("/lora-adapters", handle_lora_adapters_apply);